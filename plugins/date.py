@@ -3,6 +3,7 @@ Copyright (c) 2023, Magentix
 This code is licensed under simplified BSD license (see LICENSE for details)
 """
 from datetime import datetime
+from functools import lru_cache
 
 
 def page_data_merged(data: dict) -> dict:
@@ -11,14 +12,21 @@ def page_data_merged(data: dict) -> dict:
     """
     if 'date' not in data:
         return data
+    data.update(_get_date_formats(data['date']))
+    return data
+
+
+@lru_cache(maxsize=4096)
+def _get_date_formats(value: str) -> dict:
     try:
-        date = datetime.strptime(data['date'], '%Y-%m-%d')
-        data['date_full'] = date.strftime('%B %d, %Y')
-        data['date_rfc_3339'] = date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-4] + 'Z'
-        data['date_rfc_822'] = date.strftime('%a, %d %b %Y %H:%M:%S GMT')
+        date = datetime.strptime(value, '%Y-%m-%d')
     except ValueError:
-        data['date_full'] = data['date']
-    return data
+        return {'date_full': value}
+    return {
+        'date_full': date.strftime('%B %d, %Y'),
+        'date_rfc_3339': date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-4] + 'Z',
+        'date_rfc_822': date.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+    }
 
 
 def now(data: dict, args: dict) -> str:
@@ -2,11 +2,10 @@
 Copyright (c) 2023, Magentix
 This code is licensed under simplified BSD license (see LICENSE for details)
 """
+from functools import lru_cache
+import importlib
+
 requirement = []
-try:
-    import markdown
-except ModuleNotFoundError:
-    requirement.append('markdown module is required [pip install markdown]')
 
 
 def file_content_opened(content: str or bytes, args: dict) -> str or bytes:
@@ -18,7 +17,8 @@ def file_content_opened(content: str or bytes, args: dict) -> str or bytes:
         return content
     if args.get('_stapy').get('file_system').get_source_dir('assets') in args['path']:
         return content
-    if requirement:
+    markdown = _get_markdown()
+    if markdown is None:
         return ', '.join(requirement)
     is_bytes = isinstance(content, bytes)
     if is_bytes:
@@ -29,6 +29,18 @@ def file_content_opened(content: str or bytes, args: dict) -> str or bytes:
     return content.encode() if is_bytes else content
 
 
+@lru_cache(maxsize=None)
+def _get_markdown():
+    """
+    Import the markdown module when the first Markdown file is converted
+    """
+    try:
+        return importlib.import_module('markdown')
+    except ModuleNotFoundError:
+        requirement.append('markdown module is required [pip install markdown]')
+    return None
+
+
 def _useless_line_break(content: str) -> str:
     """
     Remove the useless br element added by "nl2br" extension
@@ -15,6 +15,26 @@ def page_navigation(data: dict, args: dict) -> str:
     return pages
 
 
+def neighbor(data: dict, args: dict) -> str:
+    """
+    Retrieve a value of the previous or next page in a json query result, or the page position
+    Ex: {: pages.neighbor query:"SELECT ITEMS WHERE \\"post\\" in tags ORDER BY date desc" item:"next" key:"title" :}
+
+    - args['query']: the json query
+    - args['item']:  previous, next, position or total (default: next)
+    - args['key']:   the page data key to return for previous and next (default: _full_path)
+    """
+    neighbors = args.get('_stapy').get('json_query').get_neighbors(args.get('query', ''), data.get('_full_path', ''))
+    item = args.get('item', 'next')
+    if item in ('position', 'total'):
+        return str(neighbors[item] or '')
+    page = neighbors.get(item)
+    if page is None:
+        return ''
+    page_data = args.get('_stapy').get('file_system').get_pages_data().get(page, {})
+    return str(page_data.get(args.get('key', '_full_path'), ''))
+
+
 def _previous(previous_page: str or None) -> str:
     """
     Retrieve the previous page link
@@ -10,19 +10,12 @@ def more_posts(data: dict, args: dict) -> str:
     Display the previous and next post
     """
     query = args.get('_stapy').get('json_query')
-    posts = query.fetch('SELECT ITEMS WHERE "post" in tags ORDER BY date desc')
-    iterator = 0
+    neighbors = query.get_neighbors('SELECT ITEMS WHERE "post" in tags ORDER BY date desc', data.get('_full_path', ''))
     post_previous = post_next = ''
-    for _key, page in posts:
-        if page.get('_full_path') == data.get('_full_path'):
-            try:
-                if iterator:
-                    post_previous = '{% block.article + ' + posts[iterator - 1][1].get('_full_path') + ' %}'
-                post_next = '{% block.article + ' + posts[iterator + 1][1].get('_full_path') + ' %}'
-            except IndexError:
-                pass
-            break
-        iterator = iterator + 1
+    if neighbors['previous'] is not None:
+        post_previous = '{% block.article + ' + neighbors['previous'].lstrip('/') + ' %}'
+    if neighbors['next'] is not None:
+        post_next = '{% block.article + ' + neighbors['next'].lstrip('/') + ' %}'
     return f'<div class="post previous">{post_previous}</div><div class="post next">{post_next}</div>'
 
 
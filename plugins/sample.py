@@ -20,6 +20,12 @@ def custom_plugin_method(data: dict, args: dict) -> str:
     return '<strong>Hello!</strong>'
 
 
+# Optional: the method result only depends on its arguments and the environment.
+# When building, the result is computed once and reused for all the pages.
+# To also depend on files, set a function returning the file paths: lambda args: [args['file']]
+custom_plugin_method.cacheable = True
+
+
 def file_content_opened(content: str or bytes, args: dict) -> str or bytes:
     """
     Update the file content when opened
@@ -48,6 +54,21 @@ def page_data_merged(data: dict, args: dict) -> dict:
     return data
 
 
+def pages_data_loaded(pages: dict, args: dict) -> dict:
+    """
+    Update the json data of all the pages at once, e.g. to compute values depending on other pages
+    Called when the pages cache is loaded and each time a page is updated
+    Always receives plain dict copies of the data merged from the json files, never the result of a previous call
+    Updates only apply to the pages cache used by the json queries
+
+    - pages:          all the pages data, e.g. {'/index.html': {...}}
+    - args['_stapy']: {
+        file_system: StapyFileSystem, json_query: StapyJsonQuery, parser: StapyParser, generator: StapyGenerator
+    }
+    """
+    return pages
+
+
 def before_content_parsed(content: str, args: dict) -> str:
     """
     Update the template content before parsing
@@ -98,7 +119,7 @@ def child_content_query_result(items: list, args: dict) -> list:
     """
     Update the query result before parsing content
 
-    - items:          children's json data
+    - items:          children's json data, updates only apply to the item
     - args['key']:    the block name
     - args['env']:    the environment name, e.g. prod
     - args['path']:   the full page path, e.g. /index.html
@@ -110,6 +131,32 @@ def child_content_query_result(items: list, args: dict) -> list:
     return items
 
 
+def build_state_saved(state: dict, args: dict) -> dict:
+    """
+    Add the values the build processes need to share with the main process (build with --jobs)
+    Called once in the main process before starting the build processes
+
+    - state:          the state sent to the build processes, values must be serializable
+    - args['_stapy']: {
+        file_system: StapyFileSystem, json_query: StapyJsonQuery, parser: StapyParser, generator: StapyGenerator
+    }
+    """
+    return state
+
+
+def build_state_loaded(state: dict, args: dict) -> dict:
+    """
+    Restore the values shared by the main process (build with --jobs)
+    Called once in each build process when it starts
+
+    - state:          the state returned by build_state_saved in the main process
+    - args['_stapy']: {
+        file_system: StapyFileSystem, json_query: StapyJsonQuery, parser: StapyParser, generator: StapyGenerator
+    }
+    """
+    return state
+
+
 def custom_http_response(response: tuple or None, args: dict) -> tuple or None:
     """
     Send custom response on a request
@@ -5,7 +5,7 @@ This code is licensed under simplified BSD license (see LICENSE for details)
 import os
 from datetime import datetime
 
-token = datetime.now().strftime('%Y%d%m%H%M%S%f')
+state = {'token': datetime.now().strftime('%Y%d%m%H%M%S%f')}
 
 
 def get_token() -> str:
@@ -13,7 +13,23 @@ def get_token() -> str:
     Returns a token generated when loading the plugin.
     Useful for getting a unique token for all pages when building.
     """
-    return token
+    return state['token']
+
+
+def build_state_saved(build_state: dict, args: dict) -> dict:
+    """
+    Shares the token with the build processes, so all the pages get the same token.
+    """
+    build_state['token'] = state['token']
+    return build_state
+
+
+def build_state_loaded(build_state: dict, args: dict) -> dict:
+    """
+    Uses the token of the main build process.
+    """
+    state['token'] = build_state.get('token', state['token'])
+    return build_state
 
 
 def get_asset_token(data: dict, args: dict) -> str:
@@ -24,7 +40,15 @@ def get_asset_token(data: dict, args: dict) -> str:
     file = args.get('file', False)
     if not file:
         raise ValueError('[get_asset_token] File argument is required')
-    path = args.get('_stapy').get('file_system').get_source_dir('assets') + os.sep + args.get('file').lstrip('/')
+    path = _get_asset_path(args)
     if not os.path.exists(path):
         raise FileNotFoundError('[get_asset_token] File does not exist: ' + path)
     return str(os.path.getmtime(path)).replace('.', '')
+
+
+def _get_asset_path(args: dict) -> str:
+    return args.get('_stapy').get('file_system').get_source_dir('assets') + os.sep + args.get('file', '').lstrip('/')
+
+
+get_token.cacheable = True
+get_asset_token.cacheable = lambda args: [_get_asset_path(args)]
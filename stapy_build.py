@@ -0,0 +1,414 @@
+"""
+Copyright (c) 2023, Magentix
+This code is licensed under simplified BSD license (see LICENSE for details)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any
+import json
+import os
+import time
+
+from stapy_fs import VERSION, StapyFileSystem
+from stapy_plugins import StapyPluginsAdapter, StapyPlugins
+from stapy_query import StapyJsonQuery
+from stapy_template import StapyEncoder, StapyParser
+
+
+class StapyGenerator:
+    def __init__(self, file_system, json_query, parser) -> None:
+        self._fs = file_system
+        self._jq = json_query
+        self._ps = parser
+        self._skip_unchanged = False
+        self._writes = {'written': 0, 'skipped': 0}
+        self._workers_stats = {}
+
+    def build(self, envs: list = None, jobs: int = 1, incremental: bool = False) -> dict:
+        if envs is None:
+            envs = []
+        tracked = incremental or self._skip_unchanged
+        (manifest, assets) = self._load_manifest(tracked)
+        if not incremental or not manifest:
+            self._jq.reset_result_cache()
+            self._ps.reset_fragment_cache()
+            self._ps.reset_directive_cache()
+        keep = list(manifest) if tracked else []
+        self.reset(envs, keep)
+        self.copy_resources(envs)
+        self._fs.get_file_cache().set_page_data(True)
+        StapyBuildWorker.generator = self
+        try:
+            pages = self.get_pages()
+            result = {}
+            states = {}
+            with self._get_pool(jobs) as pool:
+                for env in self._fs.get_environments().keys():
+                    if envs and env not in envs:
+                        continue
+                    if env != self._fs.get_local_environment():
+                        start = time.time()
+                        pages = {page: enable for page, enable in pages.items() if enable}
+                        writes = self.get_write_stats()
+                        previous = manifest.get(env, {}) if env in keep else {}
+                        (page_paths, changed) = self._get_outdated_pages(
+                            list(pages), env, previous if incremental else {}, states
+                        )
+                        self._ps.expire_fragments(changed)
+                        removed = self.remove_pages([page for page in previous if page not in pages], env)
+                        self._remove_assets(assets, env, env in keep)
+                        recorded = self._generate(pool, jobs, page_paths, env, tracked)
+                        if tracked:
+                            manifest[env] = {page: previous[page] for page in pages if page in previous}
+                            manifest[env].update(self._get_manifest_pages(recorded, states))
+                            self.save_manifest(manifest, assets)
+                        result[env] = {
+                            "number": len(page_paths),
+                            "unchanged": len(pages) - len(page_paths),
+                            "removed": removed,
+                            "written": self._writes['written'] - writes['written'],
+                            "skipped": self._writes['skipped'] - writes['skipped'],
+                            "time": round((time.time() - start), 4)
+                        }
+        except Exception:
+            self._ps.reset_fragment_cache()
+            raise
+        finally:
+            StapyBuildWorker.generator = None
+            self._fs.get_file_cache().set_page_data(False)
+        return result
+
+    def generate_pages(self, page_paths: list, env: str) -> int:
+        for page_path in page_paths:
+            try:
+                self.generate_page(page_path, env)
+            except Exception as exception:
+                raise Exception('Error when generating "' + page_path + '"\n\n' + str(exception)) from exception
+        return len(page_paths)
+
+    def record_pages(self, page_paths: list, env: str) -> dict:
+        recorded = {}
+        for page_path in page_paths:
+            self._fs.get_dependencies().record()
+            try:
+                self.generate_pages([page_path], env)
+            finally:
+                dependencies = self._fs.get_dependencies().release()
+            recorded[page_path] = sorted(dependencies, key=str)
+        return recorded
+
+    def remove_pages(self, page_paths: list, env: str) -> int:
+        removed = 0
+        root = os.path.normpath(self._fs.get_environments()[env])
+        for page_path in page_paths:
+            file = os.path.normpath(root + page_path)
+            if not os.path.isfile(file):
+                continue
+            os.unlink(file)
+            removed += 1
+            directory = os.path.dirname(file)
+            while directory.startswith(root + os.sep) and not os.listdir(directory):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+        return removed
+
+    def get_manifest_file(self) -> str:
+        return self._fs.get_root_dir('cache/build.json')
+
+    def get_manifest(self) -> dict:
+        return self._get_stored_manifest().get('environments', {})
+
+    def _get_stored_manifest(self) -> dict:
+        try:
+            with open(self.get_manifest_file(), encoding=self._fs.get_encoding()) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or manifest.get('signature') != self._get_signature():
+            return {}
+        return manifest
+
+    def _load_manifest(self, tracked: bool) -> tuple:
+        if not tracked:
+            self.remove_manifest()
+        stored = self._get_stored_manifest() if tracked else {}
+        return stored.get('environments', {}), stored.get('assets', {})
+
+    def save_manifest(self, manifest: dict, assets: dict = None) -> None:
+        self._fs.create_file(
+            self.get_manifest_file(),
+            json.dumps({'signature': self._get_signature(), 'environments': manifest, 'assets': assets or {}})
+        )
+
+    def remove_manifest(self) -> None:
+        if os.path.isfile(self.get_manifest_file()):
+            os.unlink(self.get_manifest_file())
+
+    def _remove_assets(self, assets: dict, env: str, kept: bool) -> int:
+        root = self._fs.get_source_dir('assets')
+        files = [os.path.relpath(file, root).replace(os.sep, '/') for file in self._fs.get_files(root)]
+        previous = assets.get(env, []) if kept else []
+        assets[env] = files
+        current = set(files)
+        removed = [os.path.normpath(os.path.join(root, file)) for file in previous if file not in current]
+        return self.remove_resources(removed, [env])
+
+    def _get_signature(self) -> str:
+        plugins = [item for item in self._fs.get_files(self._fs.get_plugins_dir()) if item.endswith('.py')]
+        files = [[item, self._fs.get_file_cache().get_file_version(item)] for item in plugins]
+        return json.dumps([VERSION, self._fs.get_flag('string_order')] + files)
+
+    def get_dependency_state(self, dependency: tuple) -> Any:
+        if dependency[0] == 'query':
+            return self._jq.get_digest(dependency[1], dependency[2])
+        version = self._fs.get_file_cache().get_file_version(self._fs.get_root_dir() + dependency[1])
+        return list(version) if version else None
+
+    def _get_outdated_pages(self, page_paths: list, env: str, previous: dict, states: dict) -> tuple:
+        outdated = []
+        changed = set()
+        current = set(page_paths)
+        for page_path in page_paths + [page for page in previous if page not in current]:
+            updated = page_path not in previous or not os.path.isfile(self._fs.get_environments()[env] + page_path)
+            for item in previous.get(page_path, []):
+                dependency = tuple(item[:-1])
+                if dependency not in states:
+                    states[dependency] = self.get_dependency_state(dependency)
+                if states[dependency] != item[-1]:
+                    changed.add(dependency if dependency[0] != 'file' else (
+                        'file', os.path.normpath(self._fs.get_root_dir() + dependency[1])
+                    ))
+                    updated = True
+            if updated and page_path in current:
+                outdated.append(page_path)
+        return outdated, changed
+
+    def _get_manifest_pages(self, recorded: dict, states: dict) -> dict:
+        pages = {}
+        for page_path, dependencies in recorded.items():
+            pages[page_path] = []
+            for dependency in dependencies:
+                if dependency[0] == 'file':
+                    dependency = ('file', os.path.relpath(dependency[1], self._fs.get_root_dir()))
+                if dependency not in states:
+                    states[dependency] = self.get_dependency_state(dependency)
+                pages[page_path].append([*dependency, states[dependency]])
+        return pages
+
+    def _get_pool(self, jobs: int) -> Any:
+        if jobs > 1:
+            return ProcessPoolExecutor(jobs)
+        return self._get_no_pool()
+
+    @staticmethod
+    @contextmanager
+    def _get_no_pool():
+        yield None
+
+    def _generate(self, pool: Any, jobs: int, page_paths: list, env: str, record: bool) -> dict:
+        if pool is None and record:
+            return self.record_pages(page_paths, env)
+        if pool is None:
+            self.generate_pages(page_paths, env)
+            return {}
+        size = max(1, -(-len(page_paths) // (jobs * 4)))
+        context = (self._skip_unchanged, record, self._ps.get_build_state(), self._fs.get_root_dir())
+        futures = [
+            pool.submit(StapyBuildWorker.generate, page_paths[i:i + size], env, *context)
+            for i in range(0, len(page_paths), size)
+        ]
+        recorded = {}
+        for future in futures:
+            (pages, writes, stats) = future.result()
+            recorded.update(pages)
+            for name, count in writes.items():
+                self._writes[name] += count
+            self._add_cache_stats(self._workers_stats, stats)
+        return recorded
+
+    def get_cache_stats(self, since: dict = None) -> dict:
+        stats = self._add_cache_stats(self._add_cache_stats({}, self._get_own_cache_stats()), self._workers_stats)
+        return self._add_cache_stats(stats, since or {}, -1)
+
+    @staticmethod
+    def _add_cache_stats(total: dict, stats: dict, factor: int = 1) -> dict:
+        for cache, values in stats.items():
+            for name, value in values.items():
+                if isinstance(value, int) and not isinstance(value, bool):
+                    total.setdefault(cache, {}).setdefault(name, 0)
+                    total[cache][name] += value * factor
+        return total
+
+    def _get_own_cache_stats(self) -> dict:
+        return {
+            'file': self._fs.get_file_cache().get_stats(),
+            'query': self._jq.get_result_cache_stats(),
+            'fragment': self._ps.get_fragment_cache_stats(),
+            'directive': self._ps.get_directive_cache_stats(),
+        }
+
+    def get_pages(self, full: bool = False) -> dict:
+        pages = self._fs.get_pages_data()
+        result = {}
+        for page, data in pages.items():
+            if not self._fs.get_file_extension(page):
+                continue
+            result[page] = data if full else self._fs.get_pages().is_enabled(data)
+        return result
+
+    def generate_page(self, page_path: str, env: str) -> str:
+        data = self.get_page_data(page_path)
+        try:
+            template = '{% content %}'
+            if data.get('template', False):
+                template = self._fs.get_file_content(self._fs.get_source_dir(str(data['template'])))
+        except OSError as os_error:
+            raise Exception(str(os_error)) from os_error
+        result = self._ps.process(data, template, env, page_path)
+        if env != self._fs.get_local_environment():
+            self.save_page(result, env, page_path)
+        return result
+
+    def get_page_data(self, page_path: str):
+        self._fs.get_file_content(self._fs.get_page_config(page_path))
+        return self._fs.get_page_data(page_path)
+
+    def copy_resources(self, envs: list = None) -> dict or None:
+        if envs is None:
+            envs = []
+        for env, directory in self._fs.get_environments().items():
+            if directory and (not envs or env in envs):
+                self._fs.copy_tree(self._fs.get_source_dir('assets'), directory, env)
+
+    def remove_resources(self, files: list, envs: list = None) -> int:
+        removed = 0
+        assets = self._fs.get_source_dir('assets') + os.sep
+        for env, directory in self._fs.get_environments().items():
+            if not directory or (envs and env not in envs):
+                continue
+            for file in files:
+                target = os.path.join(directory, os.path.relpath(file, assets))
+                if file.startswith(assets) and not os.path.exists(file) and os.path.isfile(target):
+                    os.unlink(target)
+                    removed += 1
+        return removed
+
+    def set_skip_unchanged(self, enabled: bool = True) -> None:
+        self._skip_unchanged = enabled
+
+    def get_write_stats(self) -> dict:
+        return dict(self._writes)
+
+    def save_page(self, content: str, env: str, page_path: str) -> bool:
+        if env == self._fs.get_local_environment():
+            return False
+        written = self._fs.create_file(
+            self._fs.get_environments()[env] + page_path, content, skip_unchanged=self._skip_unchanged
+        )
+        self._writes['written' if written else 'skipped'] += 1
+        return written
+
+    def reset(self, envs: list = None, keep: list = None) -> None:
+        if envs is None:
+            envs = []
+        if keep is None:
+            keep = []
+        if keep:
+            self._fs.get_pages().refresh()
+        else:
+            self._fs.get_pages().reset()
+        for env, path in self._fs.get_environments().items():
+            if path and (not envs or os.path.basename(path) in envs) and env not in keep:
+                self._fs.rm_directory_content(path)
+
+
+class StapyBuildWorker:
+    generator = None
+
+    @staticmethod
+    def initialize(state: dict = None, root_dir: str = None) -> None:
+        if StapyBuildWorker.generator is not None:
+            return
+        (_sp, _fs, _ps, _gs) = create_services(root_dir=root_dir)
+        _fs.get_file_cache().configure(True, False)
+        _fs.get_pages().set_index(True)
+        _ps.set_fragment_cache(True)
+        _ps.set_directive_cache(True)
+        _fs.get_file_cache().set_page_data(True)
+        _ps.set_build_state(state or {})
+        StapyBuildWorker.generator = _gs
+
+    @staticmethod
+    def generate(page_paths: list, env: str, skip_unchanged: bool, record: bool, *context) -> tuple:
+        StapyBuildWorker.initialize(*context)
+        generator = StapyBuildWorker.generator
+        generator.set_skip_unchanged(skip_unchanged)
+        writes = generator.get_write_stats()
+        stats = generator.get_cache_stats()
+        recorded = {}
+        if record:
+            recorded = generator.record_pages(page_paths, env)
+        else:
+            generator.generate_pages(page_paths, env)
+        writes = {name: count - writes[name] for name, count in generator.get_write_stats().items()}
+        return recorded, writes, generator.get_cache_stats(stats)
+
+
+class StapyWatcher:
+    _ignored = ('__pycache__',)
+
+    def __init__(self, directories: list) -> None:
+        self._directories = [os.path.normpath(directory) for directory in directories]
+        self._snapshot = self.scan()
+
+    def scan(self) -> dict:
+        snapshot = {}
+        directories = list(self._directories)
+        while directories:
+            try:
+                entries = os.scandir(directories.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or entry.name in self._ignored:
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def poll(self) -> list:
+        snapshot = self.scan()
+        files = snapshot.keys() | self._snapshot.keys()
+        changes = [file for file in files if snapshot.get(file) != self._snapshot.get(file)]
+        self._snapshot = snapshot
+        return sorted(changes)
+
+    def wait(self, interval: float) -> list:
+        changes = []
+        while not changes:
+            time.sleep(interval)
+            changes = self.poll()
+        while True:
+            time.sleep(interval)
+            burst = self.poll()
+            if not burst:
+                return sorted(set(changes))
+            changes.extend(burst)
+
+
+def create_services(reload_interval: float = 0, root_dir: str = None) -> tuple:
+    _sp = StapyPluginsAdapter()
+    _fs = StapyFileSystem(_sp, root_dir)
+    _se = StapyEncoder()
+    _jq = StapyJsonQuery(_fs, _se)
+    _ps = StapyParser(_sp, _fs, _jq, _se)
+    _gs = StapyGenerator(_fs, _jq, _ps)
+    _sp.set(StapyPlugins(_fs, _jq, _ps, _gs, reload_interval))
+    return _sp, _fs, _ps, _gs
@@ -0,0 +1,604 @@
+"""
+Copyright (c) 2023, Magentix
+This code is licensed under simplified BSD license (see LICENSE for details)
+"""
+from collections import OrderedDict
+from contextlib import closing
+from copy import deepcopy
+from pathlib import Path
+import hashlib
+import json
+import os
+import mimetypes
+import re
+import shutil
+import sqlite3
+import threading
+
+
+VERSION = '1.17.12'
+
+
+class StapyDependencies:
+    def __init__(self) -> None:
+        self._recorded = []
+
+    def is_recording(self) -> bool:
+        return bool(self._recorded)
+
+    def record(self) -> None:
+        self._recorded.append(set())
+
+    def release(self) -> set:
+        return self._recorded.pop()
+
+    def add(self, *dependencies: tuple) -> None:
+        for recorded in self._recorded:
+            recorded.update(dependencies)
+
+
+class StapyFileCache:
+    _lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self._files = OrderedDict()
+        self._config = {'enabled': False, 'validate': True, 'limit': 64 * 1024 * 1024}
+        self._stats = {'hits': 0, 'misses': 0, 'size': 0}
+        self._json = {}
+        self._layouts = {}
+        self._data = None
+        self._pages = {}
+        self._digests = {}
+
+    def configure(self, enabled: bool = True, validate: bool = True, limit: int = None) -> None:
+        self._config['enabled'] = enabled
+        self._config['validate'] = validate
+        if limit is not None:
+            self._config['limit'] = limit
+        self.reset()
+
+    def reset(self) -> int:
+        with self._lock:
+            total = len(self._files)
+            self._files = OrderedDict()
+            self._stats['size'] = 0
+        self._json = {}
+        self._layouts = {}
+        if self._data is not None:
+            self._data = {}
+        return total
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'files': len(self._files), **self._config}
+
+    def is_enabled(self) -> bool:
+        return self._config['enabled']
+
+    @staticmethod
+    def get_file_version(file: str) -> tuple or None:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_file(self, key: tuple, read) -> str:
+        cached = self._files.get(key)
+        stat = os.stat(key[0]) if self._config['validate'] or cached is None else None
+        if cached is not None and (stat is None or cached[0] == (stat.st_mtime_ns, stat.st_size)):
+            with self._lock:
+                if key in self._files:
+                    self._files.move_to_end(key)
+                self._stats['hits'] += 1
+            return cached[1]
+        with self._lock:
+            self._stats['misses'] += 1
+        content = read()
+        with self._lock:
+            self._add_file(key, (stat.st_mtime_ns, stat.st_size), content)
+        return content
+
+    def _add_file(self, key: tuple, version: tuple, content: str) -> None:
+        if key in self._files:
+            self._stats['size'] -= self._files.pop(key)[2]
+        size = len(content.encode(key[2]))
+        if size > self._config['limit']:
+            return
+        self._files[key] = (version, content, size)
+        self._stats['size'] += size
+        while self._stats['size'] > self._config['limit']:
+            self._stats['size'] -= self._files.popitem(last=False)[1][2]
+
+    def get_json(self, file: str, version: tuple, load) -> dict:
+        cached = self._json.get(file)
+        if cached is None or cached[0] != version:
+            cached = self._json[file] = (version, load())
+        return cached[1]
+
+    def get_layout(self, key: tuple, get_versions, load) -> tuple:
+        cached = self._layouts.get(key)
+        if cached is None or (self._config['validate'] and cached[0] != get_versions(cached[0])):
+            cached = self._layouts[key] = load()
+        return cached
+
+    def expire_layout(self, key: tuple, files: tuple) -> None:
+        if key in self._layouts and self._layouts[key][0] != files:
+            del self._layouts[key]
+
+    def set_page_data(self, enabled: bool = True) -> None:
+        self._data = {} if enabled else None
+
+    def has_page_data(self) -> bool:
+        return self._data is not None
+
+    def get_page_data(self, key: tuple, load) -> dict:
+        if key not in self._data:
+            cache = self._data
+            self._data = None
+            try:
+                data = load()
+            finally:
+                self._data = cache
+            self._data[key] = (data, [name for name, value in data.items() if isinstance(value, (dict, list))])
+        (data, mutable) = self._data[key]
+        data = data.copy()
+        for name in mutable:
+            data[name] = deepcopy(data[name])
+        return data
+
+    def get_page(self, key: str, version: tuple) -> dict or None:
+        loaded = self._pages.get(key)
+        return loaded[1] if loaded is not None and loaded[0] == version else None
+
+    def set_pages(self, pages: dict) -> None:
+        self._pages = pages
+
+    def get_digest(self, path: str, version: tuple) -> bytes:
+        cached = self._digests.get(path)
+        if cached is None or cached[0] != version:
+            with open(path, 'rb') as file:
+                cached = self._digests[path] = (version, hashlib.sha1(file.read()).digest())
+        return cached[1]
+
+    def set_digest(self, path: str, version: tuple, digest: bytes) -> None:
+        self._digests[path] = (version, digest)
+
+
+class StapyPages:
+    def __init__(self, plugins, file_system, cache: StapyFileCache) -> None:
+        self._sp = plugins
+        self._fs = file_system
+        self._cache = cache
+        self._pages = {}
+        self._view = None
+        self._view_disabled = None
+        self._index = None
+
+    def get_data(self, with_disabled: bool = True) -> dict:
+        if self._view is None:
+            self._refresh()
+            if self._view_disabled is None:
+                self._view_disabled = with_disabled
+            self._view = self._pages
+            if not self._view_disabled:
+                self._view = {key: data for key, data in self._pages.items() if self.is_enabled(data)}
+        return self._view
+
+    def reset(self) -> int:
+        total = len(self._pages if self._view is None else self._view)
+        self._pages = {}
+        self._cache.set_pages({})
+        self.refresh()
+        return total
+
+    def refresh(self) -> None:
+        self._view = None
+        self._view_disabled = None
+
+    def _refresh(self) -> None:
+        pages = {}
+        updated = {}
+        versions = self._fs.get_pages_versions()
+        indexed = self._index.get() if self._index and not self._pages else {}
+        for key, version in versions.items():
+            loaded = self._cache.get_page(key, version)
+            if loaded is not None:
+                pages[key] = loaded
+            elif key in indexed and indexed[key][0] == json.dumps(version):
+                pages[key] = self._merge(key, json.loads(indexed[key][1]))
+                updated[key] = None
+            elif self._index:
+                updated[key] = self._fs.get_page_data(key, dispatch=False)
+                pages[key] = self._merge(key, deepcopy(updated[key]))
+            else:
+                pages[key] = updated[key] = self._fs.get_page_data(key)
+        removed = [key for key in list(self._pages) + list(indexed) if key not in versions]
+        if updated or removed:
+            self._cache.set_pages({key: (versions[key], data) for key, data in pages.items()})
+            if self._sp.has('pages_data_loaded'):
+                pages = self._load(pages, updated)
+            self._pages = pages
+        if self._index and (removed or any(data is not None for data in updated.values())):
+            self._index.update({key: (versions[key], data) for key, data in updated.items() if data}, removed)
+
+    def _merge(self, key: str, data: dict) -> dict:
+        return self._sp.dispatch('page_data_merged', data, True, path=key)
+
+    def _load(self, pages: dict, updated: dict) -> dict:
+        copies = {key: self.copy_data(data) for key, data in pages.items()}
+        loaded = self._sp.dispatch('pages_data_loaded', copies, True)
+        return {
+            key: self._pages[key] if key not in updated and self._pages.get(key) == data else data
+            for key, data in loaded.items()
+        }
+
+    def set_index(self, enabled: bool = True, file: str = None) -> None:
+        self._index = None
+        if enabled:
+            self._index = StapyPagesIndex(file or self._fs.get_root_dir('cache/pages.db'), json.dumps([VERSION]))
+        self.reset()
+
+    def rebuild_index(self) -> int:
+        if not self._index:
+            return 0
+        self._index.clear()
+        self.reset()
+        return len(self.get_data())
+
+    def verify_index(self) -> dict:
+        result = {'valid': [], 'outdated': [], 'missing': [], 'orphaned': []}
+        indexed = self._index.get() if self._index else {}
+        for key, version in self._fs.get_pages_versions().items():
+            if key not in indexed:
+                result['missing'].append(key)
+            elif indexed[key][0] != json.dumps(version):
+                result['outdated'].append(key)
+            elif json.loads(indexed[key][1]) != self._fs.get_page_data(key, dispatch=False):
+                result['outdated'].append(key)
+            else:
+                result['valid'].append(key)
+            indexed.pop(key, None)
+        result['orphaned'] = list(indexed)
+        return result
+
+    @staticmethod
+    def is_enabled(data: dict) -> bool:
+        return 'enabled' not in data or data['enabled'] in ('1', 1, True)
+
+    @staticmethod
+    def copy_data(data: dict) -> dict:
+        copy = data.copy()
+        for name, value in data.items():
+            if isinstance(value, (dict, list)):
+                copy[name] = deepcopy(value)
+        return copy
+
+
+class StapyFileSystem:
+    def __init__(self, plugins, root_dir: str = None) -> None:
+        self._sp = plugins
+        self._root_dir = os.path.abspath(root_dir or os.path.dirname(os.path.abspath(__file__))) + os.sep
+        self._environments = {}
+        self._cache = StapyFileCache()
+        self._pages = StapyPages(plugins, self, self._cache)
+        self._dependencies = StapyDependencies()
+
+    @staticmethod
+    def get_version() -> str:
+        return VERSION
+
+    def get_root_dir(self, directory: str = '') -> str:
+        return self._root_dir + (os.path.normpath(directory) if directory else '')
+
+    def get_plugins_dir(self) -> str:
+        return self.get_root_dir() + 'plugins'
+
+    def get_build_dir(self) -> str:
+        return self.get_root_dir() + 'web'
+
+    def get_source_dir(self, directory: str = '') -> str:
+        return self.get_root_dir() + 'source' + (os.sep + os.path.normpath(directory) if directory else '')
+
+    @staticmethod
+    def get_encoding() -> str:
+        return 'utf-8'
+
+    @staticmethod
+    def get_local_environment() -> str:
+        return 'local'
+
+    def get_environments(self) -> dict:
+        if not self._environments:
+            if os.path.isdir(self.get_build_dir()):
+                for env in os.listdir(self.get_build_dir()):
+                    path = os.path.join(self.get_build_dir(), env)
+                    if os.path.isdir(path):
+                        self._environments[env] = path
+            self._environments[self.get_local_environment()] = False
+        return self._environments
+
+    def get_file_content(self, path: str, mode: str = 'r', encoding: str = None) -> str or bytes:
+        if self._dependencies.is_recording():
+            self._dependencies.add(('file', os.path.normpath(path)))
+        if encoding is None and 'b' not in mode:
+            encoding = self.get_encoding()
+        if not self._cache.is_enabled() or 'b' in mode:
+            return self._read_file(path, mode, encoding)
+        return self._cache.get_file(
+            (os.path.normpath(path), mode, encoding), lambda: self._read_file(path, mode, encoding)
+        )
+
+    def _read_file(self, path: str, mode: str, encoding: str or None) -> str or bytes:
+        with open(os.path.normpath(path), mode, encoding=encoding) as file:
+            content = file.read()
+        return self._sp.dispatch('file_content_opened', content, True, path=path, mode=mode)
+
+    def get_file_cache(self) -> StapyFileCache:
+        return self._cache
+
+    @staticmethod
+    def get_file_extension(file: str) -> str:
+        extension = os.path.splitext(file)[1]
+        if not extension:
+            extension = ''
+        return extension.replace('.', '')
+
+    @staticmethod
+    def get_file_type(file: str) -> str:
+        mime, encoding = mimetypes.guess_type(file)
+        if not mime:
+            return 'application/octet-stream'
+        if encoding:
+            return f'{mime}; charset={encoding}'
+        return mime
+
+    def get_layout_config(self, path: str) -> str:
+        return os.path.normpath(self.get_source_dir('layout') + '/' + path.lstrip('/') + '.json')
+
+    def get_page_config(self, path: str) -> str:
+        return os.path.normpath(self.get_source_dir('pages') + '/' + path.lstrip('/') + '.json')
+
+    def _get_layout_files(self, path: str) -> list:
+        extension = self.get_file_extension(path)
+        files = [self.get_layout_config('common'), self.get_layout_config(extension)]
+        directories = []
+        directory = os.path.dirname(path.strip('/'))
+        while directory:
+            directories.append(self.get_layout_config(directory + '/' + extension))
+            directories.append(self.get_layout_config(directory + '/' + 'common'))
+            directory = os.path.dirname(directory.strip('/'))
+        files.extend(reversed(directories))
+        return files
+
+    def _get_layout_data(self, path: str) -> dict:
+        layout = self._get_layout(path)
+        data = layout[1].copy()
+        for name in layout[2]:
+            data[name] = deepcopy(data[name])
+        return data
+
+    def _get_layout(self, path: str) -> tuple:
+        return self._cache.get_layout(self._get_layout_key(path), self._get_versions, lambda: self._load_layout(path))
+
+    def _load_layout(self, path: str) -> tuple:
+        files = tuple((file, self._cache.get_file_version(file)) for file in self._get_layout_files(path))
+        merged = {}
+        for file, version in files:
+            if version is not None:
+                merged.update(self._cache.get_json(file, version, lambda item=file: self.merge_json([item])))
+        return files, merged, [name for name, value in merged.items() if isinstance(value, (dict, list))]
+
+    def _get_layout_key(self, path: str) -> tuple:
+        return os.path.dirname(path.strip('/')), self.get_file_extension(path)
+
+    def _get_versions(self, files: tuple) -> tuple:
+        return tuple((file, self._cache.get_file_version(file)) for file, _version in files)
+
+    def get_page_data(self, path: str = '', merge: bool = True, dispatch: bool = True) -> dict:
+        if self._dependencies.is_recording():
+            files = (self._get_layout_files(path) if merge else []) + ([self.get_page_config(path)] if path else [])
+            self._dependencies.add(*(('file', file) for file in files))
+        if dispatch and self._cache.has_page_data():
+            return self._cache.get_page_data((path, merge), lambda: self.get_page_data(path, merge))
+        data = self._get_layout_data(path) if merge else {}
+        if path:
+            data.update(self.merge_json([self.get_page_config(path)]))
+        data['_full_path'] = path.lstrip('/')
+        data['_path'] = path.lstrip('/').replace('index.html', '')
+        return self._sp.dispatch('page_data_merged', data, True, path=path) if dispatch else data
+
+    def get_dependencies(self) -> StapyDependencies:
+        return self._dependencies
+
+    def get_pages(self) -> StapyPages:
+        return self._pages
+
+    def get_pages_data(self, with_disabled: bool = True) -> dict:
+        return self._pages.get_data(with_disabled)
+
+    def reset_pages_data(self) -> int:
+        return self._pages.reset()
+
+    @staticmethod
+    def is_enabled(data: dict) -> bool:
+        return StapyPages.is_enabled(data)
+
+    def get_pages_versions(self) -> dict:
+        versions = {}
+        layouts = {}
+        for file in self.get_files(self.get_source_dir('pages')):
+            key = re.sub(r'^' + re.escape(self.get_source_dir('pages')), '', file).replace('\\', '/')
+            key = re.sub(r'\.json$', '', key)
+            layout_key = self._get_layout_key(key)
+            if layout_key not in layouts:
+                layouts[layout_key] = tuple(
+                    (item, self._cache.get_file_version(item)) for item in self._get_layout_files(key)
+                )
+                self._cache.expire_layout(layout_key, layouts[layout_key])
+            versions[key] = (self._cache.get_file_version(file), layouts[layout_key])
+        return versions
+
+    @staticmethod
+    def create_directory(path: str) -> None:
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        Path(os.path.normpath(path)).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def rm_directory_content(src: str, except_file: list = None) -> None:
+        if except_file is None:
+            except_file = ['.git', '.gitignore', '.gitkeep']
+        src = os.path.normpath(src)
+        for item in os.listdir(src):
+            if item in except_file:
+                continue
+            path = os.path.join(src, item)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+    def create_file(
+        self, path: str, content: str = '', mode: str = 'w', encoding: str = None, skip_unchanged: bool = False
+    ) -> bool:
+        if encoding is None and 'b' not in mode:
+            encoding = self.get_encoding()
+        path = os.path.normpath(path)
+        self.create_directory(path)
+        if mode not in ('w', 'wb'):
+            with open(path, mode, encoding=encoding) as file:
+                file.write(content)
+            return True
+        content = content if 'b' in mode else content.replace('\n', os.linesep).encode(encoding)
+        digest = hashlib.sha1(content).digest()
+        path = os.path.realpath(path)
+        if skip_unchanged and self._get_digest(path) == digest:
+            return False
+        temp = os.path.join(
+            os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}-{threading.get_ident()}.tmp'
+        )
+        try:
+            with open(temp, 'wb') as file:
+                file.write(content)
+            if os.path.exists(path):
+                shutil.copymode(path, temp)
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.unlink(temp)
+        self._cache.set_digest(path, self._cache.get_file_version(path), digest)
+        return True
+
+    def _get_digest(self, path: str) -> bytes or None:
+        version = self._cache.get_file_version(path)
+        return None if version is None else self._cache.get_digest(path, version)
+
+    def copy_tree(self, src: str, dst: str, env: str = None) -> None:
+        src = os.path.normpath(src)
+        dst = os.path.normpath(dst)
+        if not os.path.exists(dst):
+            os.makedirs(dst)
+        for item in os.listdir(src):
+            source = os.path.join(src, item)
+            destination = os.path.join(dst, item)
+            if os.path.isdir(source):
+                self.copy_tree(source, destination, env)
+            else:
+                if not os.path.exists(destination) or os.stat(source).st_mtime - os.stat(destination).st_mtime > 1:
+                    content = self.get_file_content(source, 'rb')
+                    if content:
+                        self.create_file(destination, content, 'wb')
+
+    def get_files(self, src: str, files: list = None, sub_dir: bool = True) -> list:
+        if files is None:
+            files = []
+        src = os.path.normpath(src)
+        if not os.path.isdir(src):
+            return files
+        for item in os.listdir(src):
+            path = os.path.join(src, item)
+            if os.path.isdir(path):
+                if sub_dir:
+                    self.get_files(path, files)
+            else:
+                files.append(path)
+        files.sort()
+        return files
+
+    def merge_json(self, files: list) -> dict:
+        merged = json.loads('{}')
+        for file in files:
+            if os.path.exists(file):
+                with open(file, encoding=self.get_encoding()) as content:
+                    try:
+                        data = json.load(content)
+                        for (key, value) in data.items():
+                            merged[key] = value
+                    except Exception as exception:
+                        raise Exception(file + ':\n' + str(exception)) from exception
+        return merged
+
+    def get_flag(self, flag: str) -> bool:
+        return os.path.isfile(self.get_root_dir() + flag)
+
+    def is_secure(self) -> bool:
+        return self.get_flag('secure')
+
+    @staticmethod
+    def get_page_path(path: str) -> str:
+        if not path.endswith('/') and '.' not in path:
+            path += '/'
+        if path.endswith('/'):
+            path = path + 'index.html'
+        return path
+
+
+class StapyPagesIndex:
+    def __init__(self, file: str, signature: str) -> None:
+        self._file = file
+        self._signature = signature
+
+    def get(self) -> dict:
+        if not os.path.isfile(self._file):
+            return {}
+        try:
+            with closing(sqlite3.connect(self._file)) as connection:
+                meta = connection.execute('SELECT value FROM meta WHERE name = ?', ('signature',)).fetchone()
+                if meta is None or meta[0] != self._signature:
+                    return {}
+                return {row[0]: (row[1], row[2]) for row in connection.execute('SELECT path, version, data FROM pages')}
+        except sqlite3.Error:
+            return {}
+
+    def update(self, pages: dict, removed: list = None) -> None:
+        rows = []
+        for path, (version, data) in pages.items():
+            try:
+                content = json.dumps(data)
+            except (TypeError, ValueError):
+                removed = (removed or []) + [path]
+                continue
+            if json.loads(content) == data:
+                rows.append((path, json.dumps(version), content))
+        try:
+            Path(os.path.dirname(self._file)).mkdir(parents=True, exist_ok=True)
+            with closing(sqlite3.connect(self._file)) as connection:
+                with connection:
+                    self._init(connection)
+                    connection.executemany('DELETE FROM pages WHERE path = ?', [(path,) for path in removed or []])
+                    connection.executemany('REPLACE INTO pages (path, version, data) VALUES (?, ?, ?)', rows)
+        except sqlite3.Error:
+            pass
+
+    def clear(self) -> None:
+        if os.path.isfile(self._file):
+            os.unlink(self._file)
+
+    def _init(self, connection) -> None:
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS pages (path TEXT PRIMARY KEY, version TEXT, data TEXT)')
+        meta = connection.execute('SELECT value FROM meta WHERE name = ?', ('signature',)).fetchone()
+        if meta is None or meta[0] != self._signature:
+            connection.execute('DELETE FROM pages')
+            connection.execute('REPLACE INTO meta (name, value) VALUES (?, ?)', ('signature', self._signature))
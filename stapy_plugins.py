@@ -0,0 +1,242 @@
+"""
+Copyright (c) 2023, Magentix
+This code is licensed under simplified BSD license (see LICENSE for details)
+"""
+from typing import Any
+import importlib
+import importlib.util
+import os
+import re
+import sys
+import threading
+import time
+
+
+class StapyPluginsInterface:
+    def dispatch(self, method: str, value: Any, same_type: bool, args: dict) -> Any:
+        return value
+
+    def has(self, method: str) -> bool:
+        return False
+
+    def get_cache_key(self, method: str, args: dict) -> tuple or None:
+        return None
+
+    def reload(self) -> None:
+        pass
+
+
+class StapyPluginsAdapter:
+    def __init__(self) -> None:
+        self._adapter = None
+
+    def set(self, adapter: StapyPluginsInterface) -> None:
+        self._adapter = adapter
+
+    def get(self) -> StapyPluginsInterface or None:
+        return self._adapter
+
+    def dispatch(self, method: str, value: Any, same_type: bool, **kwargs) -> Any:
+        if self._adapter:
+            return self._adapter.dispatch(method, value, same_type, kwargs)
+        return value
+
+    def has(self, method: str) -> bool:
+        if self._adapter:
+            return self._adapter.has(method) if hasattr(self._adapter, 'has') else True
+        return False
+
+    def get_cache_key(self, method: str, args: dict) -> tuple or None:
+        if self._adapter and hasattr(self._adapter, 'get_cache_key'):
+            return self._adapter.get_cache_key(method, args)
+        return None
+
+    def reload(self) -> None:
+        if self._adapter:
+            self._adapter.reload()
+
+
+class StapyPlugins(StapyPluginsInterface):
+    _imported = {}
+    _names = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+    _dynamic = re.compile(r'\bimport\s+\*|\b(globals|setattr|vars|exec|__dict__|__getattr__)\b')
+
+    def __init__(self, file_system, json_query, parser, generator, reload_interval: float = 0) -> None:
+        self._fs = file_system
+        self._context = {
+            'file_system': file_system,
+            'json_query': json_query,
+            'parser': parser,
+            'generator': generator,
+            'plugins': self
+        }
+        self._state = (self._load(), {})
+        self._reload_interval = reload_interval
+        self._reload_checked = time.monotonic()
+        self._reload_lock = threading.Lock()
+
+    def dispatch(self, method: str, value: Any, same_type: bool, args: dict) -> Any:
+        type_origin = type(value)
+        for name, _method, function, arg_count in self._get_hooks(method):
+            if arg_count == 0:
+                value = function()
+            elif arg_count == 1:
+                value = function(value)
+            else:
+                args['_stapy'] = self._context
+                value = function(value, args)
+            if same_type and not isinstance(value, type_origin):
+                raise Exception(
+                    'Error in "' + name + '.' + _method + '" return statement.\n\n' +
+                    'Expected "' + type_origin.__name__ + '" object, got "' + type(value).__name__ + '"'
+                )
+        return value
+
+    def has(self, method: str) -> bool:
+        return bool(self._get_hooks(method))
+
+    def get_cache_key(self, method: str, args: dict) -> tuple or None:
+        files = None
+        for hook in self._get_hooks(method):
+            cacheable = getattr(hook[2], 'cacheable', False)
+            if not cacheable:
+                return None
+            files = files or []
+            if callable(cacheable):
+                files.extend(cacheable({**args, '_stapy': self._context}))
+        if files is None:
+            return None
+        self._fs.get_dependencies().add(*(('file', os.path.normpath(file)) for file in files))
+        versions = []
+        for file in files:
+            try:
+                versions.append((file, os.stat(file).st_mtime_ns))
+            except OSError:
+                versions.append((file, None))
+        arguments = tuple(sorted((name, str(value)) for name, value in args.items() if name not in ('path', '_stapy')))
+        return method, arguments, tuple(versions)
+
+    def _get_hooks(self, method: str) -> list:
+        (plugins, table) = self._state
+        hooks = table.get(method)
+        if hooks is None:
+            hooks = []
+            for name, plugin, _method in self._get_methods(plugins, method):
+                if plugin['names'] is not None and _method not in plugin['names']:
+                    continue
+                module = self._get_module(name, plugin)
+                if hasattr(module, _method):
+                    function = getattr(module, _method)
+                    hooks.append((name, _method, function, function.__code__.co_argcount))
+            table[method] = hooks
+        return hooks
+
+    def load(self) -> None:
+        for name, plugin in self._state[0].items():
+            self._get_module(name, plugin)
+
+    def get_profile(self) -> dict:
+        self.load()
+        profile = {}
+        for name, plugin in self._state[0].items():
+            profile[name] = {'scan': plugin['scan_time'], 'import': plugin['import_time']}
+        return profile
+
+    @staticmethod
+    def _get_methods(plugins: dict, method: str) -> list:
+        methods = []
+        for name, module in plugins.items():
+            _method = method
+            if '.' in method:
+                plugin, _method = method.split('.', 1)
+                if name not in ['plugins.' + plugin, 'plugins.' + plugin + '.main']:
+                    continue
+            if not _method:
+                raise Exception('Failed to load plugin. Method name in "' + method + '" is missing.')
+            if _method[0] == '_':
+                raise Exception('Failed to load plugin. "' + method + '" is a protected method.')
+            methods.append((name, module, _method))
+        return methods
+
+    def reload(self) -> None:
+        if self._is_reload_checked():
+            return
+        with self._reload_lock:
+            if self._is_reload_checked():
+                return
+            current = self._state[0]
+            files = self._get_plugin_files()
+            plugins = {}
+            for name in [name for name in current if name in files] + list(files):
+                if name not in plugins:
+                    plugins[name] = self._get_plugin(current, name, files[name])
+            if len(plugins) != len(current) or any(
+                    plugin is not current.get(name) for name, plugin in plugins.items()):
+                self._state = (plugins, {})
+                self._fs.get_file_cache().reset()
+                self._fs.get_pages().reset()
+            self._reload_checked = time.monotonic()
+
+    def _is_reload_checked(self) -> bool:
+        return bool(self._reload_interval) and time.monotonic() < self._reload_checked + self._reload_interval
+
+    def _get_plugin(self, plugins: dict, name: str, file: str) -> dict:
+        updated_at = os.path.getmtime(file)
+        if name in plugins and plugins[name]['updated_at'] == updated_at:
+            return plugins[name]
+        start = time.perf_counter()
+        names = self._get_plugin_names(file)
+        return {
+            'module': None,
+            'file': file,
+            'updated_at': updated_at,
+            'names': names,
+            'scan_time': time.perf_counter() - start,
+            'import_time': 0,
+        }
+
+    def _get_module(self, name: str, plugin: dict) -> Any:
+        if plugin['module'] is None:
+            start = time.perf_counter()
+            if name not in sys.modules:
+                module = importlib.import_module(name)
+            elif self._imported.get(name) != plugin['updated_at']:
+                module = self._import(name, plugin['file'])
+            else:
+                module = sys.modules[name]
+            self._imported[name] = plugin['updated_at']
+            plugin['import_time'] = time.perf_counter() - start
+            plugin['module'] = module
+        return plugin['module']
+
+    def _get_plugin_names(self, file: str) -> set or None:
+        with open(file, 'r', encoding='utf-8') as source:
+            content = source.read()
+        if self._dynamic.search(content):
+            return None
+        return set(self._names.findall(content))
+
+    @staticmethod
+    def _import(name: str, file: str) -> Any:
+        spec = importlib.util.spec_from_file_location(name, file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[name] = module
+        return module
+
+    def _load(self) -> dict:
+        return {name: self._get_plugin({}, name, file) for name, file in self._get_plugin_files().items()}
+
+    def _get_plugin_files(self) -> dict:
+        plugins = {}
+        src = os.path.normpath(self._fs.get_plugins_dir())
+        for item in os.listdir(src):
+            path = os.path.join(src, item)
+            if os.path.isdir(path):
+                file = path + os.sep + 'main.py'
+                if os.path.isfile(file):
+                    plugins['plugins.' + os.path.basename(path) + '.main'] = file
+            else:
+                if path.endswith('.py'):
+                    plugins['plugins.' + os.path.basename(path).replace('.py', '')] = path
+        return plugins
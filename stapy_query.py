@@ -0,0 +1,586 @@
+"""
+Copyright (c) 2023, Magentix
+This code is licensed under simplified BSD license (see LICENSE for details)
+"""
+from collections.abc import MutableMapping
+from typing import Any
+import ast
+import hashlib
+import heapq
+import json
+import operator
+import re
+
+
+class StapyJsonQueryCache:
+    _results_limit = 1000
+
+    def __init__(self) -> None:
+        self._results = {}
+        self._collections = {}
+        self._sorted = {}
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get_results(self, key: tuple, fetch) -> tuple:
+        results = self._results.get(key)
+        if results is None:
+            self._stats['misses'] += 1
+            if len(self._results) >= self._results_limit:
+                self._results = {}
+                self._collections = {}
+            results = self._results[key] = tuple(fetch())
+        else:
+            self._stats['hits'] += 1
+        return results
+
+    def get_positions(self, key: tuple, results: tuple) -> dict:
+        positions = self._collections.get(key)
+        if positions is None:
+            positions = self._collections[key] = {}
+            for position, (_result, page) in enumerate(results):
+                positions.setdefault(page, position)
+        return positions
+
+    def get_sorted(self, field: str, load) -> list:
+        entries = self._sorted.get(field)
+        if entries is None:
+            entries = self._sorted[field] = load()
+        return entries
+
+    def clear(self) -> None:
+        self._results = {}
+        self._collections = {}
+        self._sorted = {}
+
+    def reset(self) -> None:
+        self._results = {}
+        self._collections = {}
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get_stats(self) -> dict:
+        return {**self._stats, 'queries': len(self._results)}
+
+
+class StapyJsonQuery:
+    _plans_limit = 1000
+    _numbers = re.compile(r'^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$')
+    _dates = re.compile(
+        r'^([0-9]{4})-([0-9]{2})-([0-9]{2})(?:[T ]([0-9]{2}):([0-9]{2})(?::([0-9]{2})(?:\.([0-9]+))?)?)?$'
+    )
+    _operators = {
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+        ast.Gt: operator.gt,
+        ast.Lt: operator.lt,
+        ast.GtE: operator.ge,
+        ast.LtE: operator.le,
+        ast.In: lambda value, container: value in container,
+        ast.NotIn: lambda value, container: value not in container,
+    }
+
+    def __init__(self, file_system, encoder) -> None:
+        self._fs = file_system
+        self._se = encoder
+        self._plans = {}
+        self._indexes = {}
+        self._indexed = None
+        self._positions = {}
+        self._typed_order = not file_system.get_flag('string_order')
+        self._cache = StapyJsonQueryCache()
+
+    def fetch(self, query: str, with_disabled: bool = False) -> list:
+        (pages, _key, results) = self._get_results(query, with_disabled)
+        return [(result, self._fs.get_pages().copy_data(pages[page])) for result, page in results]
+
+    def fetch_views(self, query: str, with_disabled: bool = False) -> list:
+        (pages, _key, results) = self._get_results(query, with_disabled)
+        return [(result, StapyPageView(pages[page])) for result, page in results]
+
+    def get_neighbors(self, query: str, path: str, with_disabled: bool = False) -> dict:
+        (_pages, key, results) = self._get_results(query, with_disabled)
+        position = self._cache.get_positions(key, results).get('/' + path.lstrip('/'))
+        if position is None:
+            return {'position': None, 'total': len(results), 'previous': None, 'next': None}
+        return {
+            'position': position + 1,
+            'total': len(results),
+            'previous': results[position - 1][1] if position else None,
+            'next': results[position + 1][1] if position + 1 < len(results) else None,
+        }
+
+    def get_digest(self, query: str, with_disabled: bool = False) -> str:
+        (pages, _key, results) = self._get_results(query, with_disabled)
+        content = json.dumps([[result, page, pages[page]] for result, page in results], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _get_results(self, query: str, with_disabled: bool) -> tuple:
+        self._fs.get_dependencies().add(('query', query, with_disabled))
+        plan = self._get_plan(query)
+        pages = self._fs.get_pages_data(with_disabled)
+        if pages is not self._indexed:
+            self._sync_indexes(pages)
+        key = (plan[3], plan[1], plan[2], self._typed_order, with_disabled)
+        return pages, key, self._cache.get_results(key, lambda: self._fetch(query, pages, plan))
+
+    def _fetch(self, query: str, pages: dict, plan: tuple) -> list:
+        (where, order, limit, source, access, safe) = plan
+        candidates = pages if access is None else self._lookup(access, pages)
+        try:
+            if not self._typed_order:
+                return self._fetch_strings(pages, candidates, where, order, limit)
+            if order[0] and safe and limit[1] * 4 < len(candidates):
+                return self._fetch_sorted(pages, candidates, where, order, limit)
+            return self._fetch_typed(pages, candidates, where, order, limit)
+        except TypeError as type_error:
+            raise TypeError(str(type_error) + '\n\n' + query + '\n\nWhere: ' + source) from type_error
+
+    def set_typed_order(self, enabled: bool = True) -> None:
+        self._typed_order = enabled
+
+    def reset_result_cache(self) -> None:
+        self._cache.reset()
+
+    def get_result_cache_stats(self) -> dict:
+        return self._cache.get_stats()
+
+    def _fetch_strings(self, pages: dict, candidates, where, order: tuple, limit: tuple) -> list:
+        rows = pages if candidates is pages else sorted(candidates, key=self._positions.get)
+        search = {}
+        i = 0
+        for key in rows:
+            data = pages[key]
+            if where and not where(data):
+                continue
+            search[str(data[order[0]]) + str(i) if order[0] and order[0] in data else '!' + str(i)] = key
+            i += 1
+        return sorted(search.items(), reverse=order[1] == 'desc')[limit[0]:limit[1]]
+
+    def _fetch_typed(self, pages: dict, candidates, where, order: tuple, limit: tuple) -> list:
+        matches = []
+        for key in candidates:
+            data = pages[key]
+            if where and not where(data):
+                continue
+            matches.append((self._get_sort_key(data, order[0]) + (self._positions[key],), key))
+        if limit[1] * 4 < len(matches):
+            matches = (heapq.nlargest if order[1] == 'desc' else heapq.nsmallest)(limit[1], matches)
+        else:
+            matches.sort(reverse=order[1] == 'desc')
+        return [self._get_result(pages[key], key, order[0], sort[-1]) for sort, key in matches[limit[0]:limit[1]]]
+
+    def _fetch_sorted(self, pages: dict, candidates, where, order: tuple, limit: tuple) -> list:
+        entries = self._cache.get_sorted(order[0], lambda: sorted(
+            (self._get_sort_key(data, order[0]) + (self._positions[key],), key) for key, data in pages.items()
+        ))
+        results = []
+        for sort, key in reversed(entries) if order[1] == 'desc' else entries:
+            if len(results) >= limit[1]:
+                break
+            if key in candidates and (not where or where(pages[key])):
+                results.append(self._get_result(pages[key], key, order[0], sort[-1]))
+        return results[limit[0]:]
+
+    @staticmethod
+    def _get_result(data: dict, key: str, field: str, position: int) -> tuple:
+        return str(data[field]) + str(position) if field and field in data else '!' + str(position), key
+
+    def _get_sort_key(self, data: dict, field: str) -> tuple:
+        value = data.get(field) if field else None
+        if value is None:
+            return 0, 0
+        if isinstance(value, (int, float)):
+            return 1, value
+        if not isinstance(value, str):
+            return 4, str(value)
+        if self._numbers.match(value):
+            return 1, float(value)
+        date = self._dates.match(value)
+        if date:
+            parts = date.groups()
+            return 2, tuple(int(part or 0) for part in parts[0:6]) + ((parts[6] or '').ljust(9, '0'), value)
+        return 3, value
+
+    def build(self, query: str) -> tuple:
+        return self._get_plan(query)[0:3]
+
+    def _get_plan(self, query: str) -> tuple:
+        plan = self._plans.get(query)
+        if plan is None:
+            if len(self._plans) >= self._plans_limit:
+                self._plans = {}
+            (where, order, limit) = self._parse(query)
+            (predicate, access, safe) = self._compile_where(where)
+            plan = self._plans[query] = (predicate, order, limit, where or '', access, safe)
+        return plan
+
+    def _compile_where(self, where: str or None) -> tuple:
+        if not where:
+            return None, None, True
+        try:
+            node = ast.parse(where.strip(' '), mode='eval').body
+            return (self._compile_node(node),) + self._plan_access(node, frozenset())
+        except ValueError as value_error:
+            raise ValueError(str(value_error) + '\n\nWhere: ' + where) from value_error
+
+    def _compile_node(self, node):
+        if isinstance(node, ast.BoolOp):
+            operands = tuple(self._compile_node(value) for value in node.values)
+            if isinstance(node.op, ast.And):
+                return lambda data: all(operand(data) for operand in operands)
+            return lambda data: any(operand(data) for operand in operands)
+        if isinstance(node, ast.Compare):
+            return self._compile_compare(node)
+        if isinstance(node, ast.Name):
+            return self._compile_name(node.id)
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'data':
+            key = ast.literal_eval(node.slice.value if type(node.slice).__name__ == 'Index' else node.slice)
+            return lambda data: data[key]
+        value = ast.literal_eval(node)
+        return lambda data: value
+
+    @staticmethod
+    def _compile_name(name: str):
+        if name == 'data':
+            return lambda data: data
+
+        def undefined(data):
+            raise NameError(f'name \'{name}\' is not defined')
+        return undefined
+
+    def _compile_compare(self, node):
+        if any(type(op) not in self._operators for op in node.ops):
+            raise ValueError('Unsupported comparison operator')
+        left = self._compile_node(node.left)
+        comparators = tuple(
+            (self._operators[type(op)], self._compile_node(value)) for op, value in zip(node.ops, node.comparators)
+        )
+        if len(comparators) == 1:
+            (compare, right) = comparators[0]
+            return lambda data: compare(left(data), right(data))
+
+        def chain(data):
+            value = left(data)
+            for function, comparator in comparators:
+                other = comparator(data)
+                if not function(value, other):
+                    return False
+                value = other
+            return True
+        return chain
+
+    def _plan_access(self, node, present: frozenset) -> tuple:
+        if isinstance(node, ast.Compare) and len(node.ops) == 1:
+            return self._plan_compare(node.left, node.ops[0], node.comparators[0], present)
+        if not isinstance(node, ast.BoolOp):
+            return None, False
+        parts = []
+        safe = True
+        known = set(present)
+        for value in node.values:
+            (access, value_safe) = self._plan_access(value, frozenset(known))
+            if isinstance(node.op, ast.Or) or (safe and access):
+                parts.append(access)
+            if isinstance(node.op, ast.And) and access and access[0] == 'key':
+                known.add(access[1])
+            safe = safe and value_safe
+        if isinstance(node.op, ast.Or):
+            return ('or', tuple(parts)) if all(parts) else None, safe
+        return ('and', tuple(parts)) if parts else None, safe
+
+    def _plan_compare(self, left, operation, right, present: frozenset) -> tuple:
+        field = self._get_field(right)
+        if isinstance(operation, (ast.Eq, ast.NotEq)) and field is None:
+            (left, right, field) = (right, left, self._get_field(left))
+        try:
+            value = ast.literal_eval(left if field is not None or isinstance(operation, ast.In) else right)
+        except ValueError:
+            return None, False
+        if type(value) not in StapyJsonQueryIndex.scalars:
+            return None, False
+        if isinstance(operation, ast.In) and isinstance(right, ast.Name) and right.id == 'data':
+            return ('key', value), True
+        if field not in present:
+            return None, False
+        if isinstance(operation, ast.In):
+            return ('item', field, value), False
+        if isinstance(operation, ast.Eq):
+            return ('value', field, value), True
+        return None, isinstance(operation, ast.NotEq)
+
+    @staticmethod
+    def _get_field(node) -> str or None:
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'data':
+            field = ast.literal_eval(node.slice.value if type(node.slice).__name__ == 'Index' else node.slice)
+            return field if isinstance(field, str) else None
+        return None
+
+    def _lookup(self, access: tuple, pages: dict) -> set:
+        if access[0] == 'or':
+            return set().union(*(self._lookup(part, pages) for part in access[1]))
+        if access[0] == 'and':
+            results = sorted((self._lookup(part, pages) for part in access[1]), key=len)
+            return results[0].intersection(*results[1:])
+        query_index = self._indexes.get(access[0:2])
+        if query_index is None:
+            query_index = self._indexes[access[0:2]] = StapyJsonQueryIndex(access[0], access[1])
+            for key, data in pages.items():
+                query_index.add(key, data)
+        return query_index.lookup(access[2] if len(access) > 2 else True)
+
+    def _sync_indexes(self, pages: dict) -> None:
+        previous = self._indexed or {}
+        changed = [key for key, data in pages.items() if previous.get(key) is not data]
+        removed = [key for key in previous if key not in pages]
+        for query_index in self._indexes.values():
+            for key in changed + removed:
+                query_index.remove(key)
+            for key in changed:
+                query_index.add(key, pages[key])
+        self._indexed = pages
+        self._positions = {key: position for position, key in enumerate(pages)}
+        self._cache.clear()
+
+    def _parse(self, query: str) -> tuple:
+        where = order = limit = None
+        build_where = 0
+        keys = self._extract_keywords(self._format_keywords(self._se.encode_exp(query)))
+        for _i, keyword in enumerate(keys):
+            if keyword == 'SELECT-ITEMS':
+                limit = self._build_limit(keys, _i)
+                build_where = 0
+            elif keyword == 'ORDER-BY':
+                order = self._build_sort_order(keys, _i)
+                build_where = 0
+            elif build_where > 2 and keyword.upper() in ['OR', 'AND']:
+                where += f'{keyword.lower()} '
+                build_where = 1
+                continue
+            elif build_where and keyword in ['(', ')']:
+                where += f'{keyword} '
+                continue
+            elif build_where:
+                if build_where == 1:
+                    try:
+                        where += f'{self._build_where_part_1(keys, keyword, _i)} '
+                    except IndexError:
+                        build_where = 0
+                        continue
+                elif build_where == 2:
+                    where += f'{self._build_where_part_2(keys, keyword, _i)} '
+                elif build_where == 3:
+                    where += f'{self._build_where_part_3(keys, keyword, _i)} '
+                build_where += 1
+            elif keyword.upper() == 'WHERE':
+                where = ''
+                build_where = 1
+        return where, self._format_order(order), self._format_limit(limit)
+
+    def _build_limit(self, _keys: list, _i: int) -> tuple or None:
+        _limit = None
+        try:
+            if re.search(r'^([0-9]+)-([0-9]+)$', _keys[_i + 1]):
+                _limit = self._string_to_tuple(_keys[_i + 1].replace('-', ':'))
+            if re.search(r'^([0-9]+)$', _keys[_i + 1]):
+                _limit = self._string_to_tuple(_keys[_i + 1])
+        except IndexError:
+            pass
+        return _limit
+
+    def _build_sort_order(self, _keys: list, _i: int) -> tuple or None:
+        try:
+            _order = _keys[_i + 1] + ':'
+        except IndexError:
+            return None
+        try:
+            if _keys[_i + 2].lower() in ('asc', 'desc'):
+                _order += _keys[_i + 2].lower()
+            else:
+                _order += 'asc'
+        except IndexError:
+            _order += 'asc'
+        return self._string_to_tuple(_order)
+
+    def _build_where_part_1(self, _keys: list, _keyword: str, _i: int) -> str:
+        if _keys[_i + 1].lower() in ['in', 'not-in']:
+            return f'("{self._format_data_key(_keys[_i + 2])}" in data and ' + self._format_data_value(_keyword)
+        return f'("{self._format_data_key(_keyword)}" in data and data["{self._format_data_key(_keyword)}"]'
+
+    @staticmethod
+    def _build_where_part_2(_keys: list, _keyword: str, _i: int) -> str:
+        if _keyword.lower() in ['=', '>', '<', '!=', '>=', '<=', 'in', 'not-in']:
+            if _keyword == "not-in":
+                return 'not in'
+            if _keyword.lower() != "=":
+                return _keyword.lower()
+        return '=='
+
+    def _build_where_part_3(self, _keys: list, _keyword: str, _i: int) -> str:
+        if _keys[_i - 1].lower() in ['in', 'not-in']:
+            return f'data["{self._format_data_key(_keyword)}"])'
+        return self._format_data_value(_keyword) + ')'
+
+    def _string_to_tuple(self, string: str) -> tuple:
+        return tuple(self._se.decode_exp(item) for item in string.split(':'))
+
+    @staticmethod
+    def _format_order(order: tuple = None) -> tuple:
+        if order is None:
+            order = ('', 'asc')
+        if len(order) == 1:
+            order = (order[0], 'asc')
+        return order
+
+    @staticmethod
+    def _format_limit(limit: tuple = None) -> tuple:
+        if limit is None:
+            limit = (1, 10000)
+        if len(limit) == 1:
+            limit = (limit[0], limit[0])
+        return int(limit[0]) - 1 if int(limit[0]) > 0 else 0, int(limit[1])
+
+    @staticmethod
+    def _extract_keywords(_query: str) -> list:
+        conditions = [')', '(', '=', '>', '<', '! =', '>  =', '<  =']
+        for condition in conditions:
+            _query = _query.replace(condition, f' {condition.replace(" ", "")} ')
+        return re.sub(' +', ' ', _query).split(' ')
+
+    def _format_data_key(self, _keyword: str, escape: bool = True) -> str:
+        _keyword = self._se.decode_exp(_keyword.replace('"', '').replace("'", ''))
+        if escape:
+            _keyword = _keyword.replace('"', '\\"')
+        return _keyword
+
+    def _format_data_value(self, _keyword: str) -> str:
+        is_str = False
+        for enclosed in ['"', "'"]:
+            if _keyword.startswith(enclosed) and _keyword.endswith(enclosed):
+                is_str = True
+        _keyword = self._format_data_key(_keyword)
+        if _keyword.lower() in ['true', 'false']:
+            return _keyword.capitalize()
+        if is_str:
+            return f'"{_keyword}"'
+        return _keyword
+
+    @staticmethod
+    def _format_keywords(_query: str) -> str:
+        _keywords = {'SELECT ITEMS': 'SELECT-ITEMS', 'ORDER BY': 'ORDER-BY', 'not in': 'not-in'}
+        for _from, _to in _keywords.items():
+            _query = re.compile(re.escape(_from), re.IGNORECASE).sub(_to, _query)
+        return _query
+
+
+class StapyJsonQueryIndex:
+    scalars = (str, int, float, bool, type(None))
+
+    def __init__(self, kind: str, field: str) -> None:
+        self.kind = kind
+        self.field = field
+        self._postings = {}
+        self._residual = set()
+        self._entries = {}
+
+    def add(self, key: str, data: dict) -> None:
+        if self.field not in data:
+            return
+        values = self._get_values(data[self.field])
+        if values is None:
+            self._residual.add(key)
+        for value in values or ():
+            self._postings.setdefault(value, set()).add(key)
+        self._entries[key] = values
+
+    def remove(self, key: str) -> None:
+        if key not in self._entries:
+            return
+        values = self._entries.pop(key)
+        if values is None:
+            self._residual.discard(key)
+        for value in values or ():
+            self._postings[value].discard(key)
+            if not self._postings[value]:
+                del self._postings[value]
+
+    def lookup(self, value: Any) -> set:
+        return self._postings.get(value, set()) | self._residual
+
+    def _get_values(self, value: Any) -> tuple or None:
+        if self.kind == 'key':
+            return (True,)
+        if self.kind == 'value':
+            return (value,) if type(value) in self.scalars else None
+        if isinstance(value, (list, tuple)) and all(type(item) in self.scalars for item in value):
+            return tuple(set(value))
+        return None
+
+
+class StapyPageView(MutableMapping):
+    __slots__ = ('_data', '_changes')
+    _deleted = object()
+
+    def __init__(self, data: dict) -> None:
+        self._data = data
+        self._changes = None
+
+    def __getitem__(self, key: str) -> Any:
+        if self._changes and key in self._changes:
+            if self._changes[key] is self._deleted:
+                raise KeyError(key)
+            return self._changes[key]
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if self._changes is None:
+            self._changes = {}
+        self._changes[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self[key] = self._deleted
+
+    def __contains__(self, key: Any) -> bool:
+        if self._changes and key in self._changes:
+            return self._changes[key] is not self._deleted
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._get_merged())
+
+    def __len__(self) -> int:
+        return len(self._get_merged())
+
+    def __repr__(self) -> str:
+        return repr(self._get_merged())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def keys(self):
+        return self._get_merged().keys()
+
+    def items(self):
+        return self._get_merged().items()
+
+    def values(self):
+        return self._get_merged().values()
+
+    def copy(self) -> dict:
+        return dict(self._get_merged())
+
+    def get_data(self) -> dict:
+        for key, value in (self._changes or {}).items():
+            origin = self._data.get(key, self._deleted)
+            if origin is not value and (type(origin) is not type(value) or origin != value):
+                return self.copy()
+        return self._data
+
+    def _get_merged(self) -> dict:
+        if not self._changes:
+            return self._data
+        merged = {**self._data, **self._changes}
+        for key, value in self._changes.items():
+            if value is self._deleted:
+                del merged[key]
+        return merged
@@ -0,0 +1,746 @@
+"""
+Copyright (c) 2023, Magentix
+This code is licensed under simplified BSD license (see LICENSE for details)
+"""
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping, MutableMapping
+from typing import Any
+import hashlib
+import os
+import re
+
+from stapy_query import StapyJsonQueryIndex
+
+
+class StapyScope(MutableMapping):
+    __slots__ = ('_data', '_local', '_masked', 'frames')
+
+    def __init__(self, data: dict, local: dict = None, masked: tuple = (), frames: list = None) -> None:
+        self._data = data
+        self._local = {} if local is None else local
+        self._masked = set()
+        if isinstance(data, StapyScope):
+            (self._data, parent, masked_keys) = data.get_layers()
+            self._local = {**parent, **self._local}
+            self._masked = masked_keys - self._local.keys()
+        for key in masked:
+            self._local.pop(key, None)
+            self._masked.add(key)
+        self.frames = frames
+
+    def __getitem__(self, key: str) -> Any:
+        if self.frames:
+            self._record(key)
+        if key in self._masked:
+            raise KeyError(key)
+        if key in self._local:
+            return self._local[key]
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._masked.discard(key)
+        self._local[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._local.pop(key, None)
+        self._masked.add(key)
+
+    def __contains__(self, key: Any) -> bool:
+        if self.frames:
+            self._record(key)
+        return key not in self._masked and (key in self._local or key in self._data)
+
+    def __iter__(self):
+        return iter(self.copy())
+
+    def __len__(self) -> int:
+        return len(self.copy())
+
+    def __eq__(self, other: Any) -> bool:
+        if other is self:
+            return True
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.copy() == dict(other.items())
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        if key in self._masked:
+            return default
+        if key in self._local:
+            return self._local[key]
+        return self._data.get(key, default)
+
+    def get_layers(self) -> tuple:
+        return self._data, self._local, self._masked
+
+    def get_data(self) -> dict:
+        merged = {**self._data, **self._local}
+        for key in self._masked:
+            merged.pop(key, None)
+        return merged
+
+    def keys(self):
+        return self.copy().keys()
+
+    def items(self):
+        return self.copy().items()
+
+    def values(self):
+        return self.copy().values()
+
+    def copy(self) -> dict:
+        if self.frames:
+            self._record(None)
+        return self.get_data()
+
+    def _record(self, key: Any) -> None:
+        for frame in self.frames:
+            if key is None:
+                frame['volatile'] = True
+            else:
+                frame['reads'].add(key)
+
+
+StapyTemplate = namedtuple('StapyTemplate', ('source', 'nodes'))
+StapyTemplate.__new__.__defaults__ = (None,)
+
+StapyNode = namedtuple('StapyNode', ('kind', 'raw', 'expr', 'name', 'cleaned', 'args', 'pieces'))
+StapyNode.__new__.__defaults__ = ('', '', None, None, None)
+
+
+class StapyParserCache:
+    _compiled_limit = 1000
+    _directives_limit = 10000
+
+    def __init__(self) -> None:
+        self._templates = {}
+        self._compiled = {}
+        self._fragments = None
+        self._fragments_limit = 0
+        self._fragments_size = 0
+        self._fragments_stats = {}
+        self._directives = None
+        self._directives_stats = {}
+
+    def get_template(self, file: str, updated_at: float, content: str, compile_content) -> StapyTemplate:
+        cached = self._templates.get(file)
+        if cached is not None and cached[0] == updated_at and cached[1] == content:
+            return cached[2]
+        template = compile_content(content)
+        self._templates[file] = (updated_at, content, template)
+        return template
+
+    def compile(self, content: str, tokenize) -> StapyTemplate:
+        template = self._compiled.get(content)
+        if template is None:
+            if len(self._compiled) >= self._compiled_limit:
+                self._compiled = {}
+            template = self._compiled[content] = tokenize(content)
+        return template
+
+    def set_fragment_cache(self, enabled: bool = True, limit: int = 32 * 1024 * 1024) -> None:
+        self._fragments = OrderedDict() if enabled else None
+        self._fragments_limit = limit
+        self.reset_fragment_cache()
+
+    def reset_fragment_cache(self) -> None:
+        if self._fragments is not None:
+            self._fragments.clear()
+        self._fragments_size = 0
+        self._fragments_stats = {}
+
+    def has_fragments(self) -> bool:
+        return self._fragments is not None
+
+    def get_fragment_cache_stats(self) -> dict:
+        return {
+            'hits': sum(stats['hits'] for stats in self._fragments_stats.values()),
+            'misses': sum(stats['misses'] for stats in self._fragments_stats.values()),
+            'fragments': sum(len(outputs) for item in (self._fragments or {}).values() for outputs in item.values()),
+            'size': self._fragments_size,
+            'blocks': {block: dict(stats) for block, stats in self._fragments_stats.items()},
+        }
+
+    def get_fragment(self, key: tuple, get_values) -> tuple or None:
+        stats = self._fragments_stats.setdefault(key[0], {'hits': 0, 'misses': 0})
+        for variant, outputs in self._fragments.get(key, {}).items():
+            cached = outputs.get(get_values(variant))
+            if cached is not None:
+                self._fragments.move_to_end(key)
+                stats['hits'] += 1
+                return variant, cached
+        stats['misses'] += 1
+        return None
+
+    def add_fragment(self, key: tuple, variant: tuple, values: tuple, result: str, dependencies: set) -> None:
+        outputs = self._fragments.setdefault(key, {}).setdefault(variant, {})
+        outputs[values] = (result, tuple(dependencies))
+        self._fragments.move_to_end(key)
+        self._fragments_size += len(result)
+        while self._fragments_size > self._fragments_limit and len(self._fragments) > 1:
+            for outputs in self._fragments.popitem(last=False)[1].values():
+                self._fragments_size -= sum(len(output[0]) for output in outputs.values())
+
+    def expire_fragments(self, dependencies: set) -> int:
+        expired = 0
+        for key, item in list((self._fragments or {}).items()) if dependencies else []:
+            for variant, outputs in list(item.items()):
+                for values, (result, recorded) in list(outputs.items()):
+                    if dependencies.isdisjoint(recorded):
+                        continue
+                    del outputs[values]
+                    self._fragments_size -= len(result)
+                    expired += 1
+                if not outputs:
+                    del item[variant]
+            if not item:
+                del self._fragments[key]
+        return expired
+
+    def set_directive_cache(self, enabled: bool = True) -> None:
+        self._directives = {} if enabled else None
+        self.reset_directive_cache()
+
+    def reset_directive_cache(self) -> None:
+        if self._directives is not None:
+            self._directives.clear()
+        self._directives_stats = {}
+
+    def has_directives(self) -> bool:
+        return self._directives is not None
+
+    def get_directive_cache_stats(self) -> dict:
+        return {
+            'hits': sum(stats['hits'] for stats in self._directives_stats.values()),
+            'calls': sum(stats['calls'] for stats in self._directives_stats.values()),
+            'directives': {method: dict(stats) for method, stats in self._directives_stats.items()},
+        }
+
+    def get_directive(self, method: str, key: tuple or None, default: Any) -> Any:
+        stats = self._directives_stats.setdefault(method, {'hits': 0, 'calls': 0})
+        if key is not None and self._directives is not None and key in self._directives:
+            stats['hits'] += 1
+            return self._directives[key]
+        stats['calls'] += 1
+        return default
+
+    def add_directive(self, key: tuple or None, result: str or None) -> None:
+        if key is not None and self._directives is not None:
+            if len(self._directives) >= self._directives_limit:
+                self._directives.clear()
+            self._directives[key] = result
+
+
+class StapyParser:
+    _bounds = {'var': ('{{', '}}'), 'plugin': ('{:', ':}'), 'block': ('{%', '%}')}
+    _expressions = {
+        bounds: re.compile(r'' + bounds[0] + '(?!' + bounds[0] + ')(.*?)' + bounds[1], flags=re.DOTALL)
+        for bounds in _bounds.values()
+    }
+    _unsafe = ('{{', '}}', '{%', '%}', '{:')
+    _missing = object()
+
+    def __init__(self, plugins, file_system, json_query, encoder) -> None:
+        self._sp = plugins
+        self._fs = file_system
+        self._jq = json_query
+        self._se = encoder
+        self._env = ''
+        self._path = ''
+        self._frames = []
+        self._cache = StapyParserCache()
+
+    def process(self, data: dict, content: str, env: str, path: str = '') -> str:
+        self._env = env
+        self._path = path
+        data['_env'] = env
+        content = self._sp.dispatch('before_content_parsed', content, True, data=data, env=env, path=path)
+        content = self._parse(data, content)
+        content = self.clean(content)
+        content = self._sp.dispatch('after_content_parsed', content, True, data=data, env=env, path=path)
+        return content
+
+    def clean(self, content: str):
+        if '{{' in content or '{:' in content or '{%' in content:
+            tags = self._find_expressions(('{{', '}}'), content) + \
+                   self._find_expressions(('{:', ':}'), content) + \
+                   self._find_expressions(('{%', '%}'), content)
+            for tag in tags:
+                content = content.replace(tag[0], '')
+        if '^' not in content:
+            return content
+        return content.replace(self._se.hash('{'), '{').replace(self._se.hash('}'), '}')
+
+    def compile(self, content: str) -> StapyTemplate:
+        return self._cache.compile(content, self._tokenize)
+
+    def set_fragment_cache(self, enabled: bool = True, limit: int = 32 * 1024 * 1024) -> None:
+        self._cache.set_fragment_cache(enabled, limit)
+
+    def reset_fragment_cache(self) -> None:
+        self._cache.reset_fragment_cache()
+
+    def get_fragment_cache_stats(self) -> dict:
+        return self._cache.get_fragment_cache_stats()
+
+    def expire_fragments(self, dependencies: set) -> int:
+        return self._cache.expire_fragments(dependencies)
+
+    def set_directive_cache(self, enabled: bool = True) -> None:
+        self._cache.set_directive_cache(enabled)
+
+    def reset_directive_cache(self) -> None:
+        self._cache.reset_directive_cache()
+
+    def get_directive_cache_stats(self) -> dict:
+        return self._cache.get_directive_cache_stats()
+
+    def get_build_state(self) -> dict:
+        return self._sp.dispatch('build_state_saved', {}, True)
+
+    def set_build_state(self, state: dict) -> None:
+        self._sp.dispatch('build_state_loaded', state, True)
+
+    def get_template(self, file: str) -> StapyTemplate:
+        content = self._fs.get_file_content(file)
+        return self._cache.get_template(file, os.path.getmtime(file), content, self.compile)
+
+    def _parse(self, data: dict, content: str) -> str:
+        return self._render(data, self.compile(content))
+
+    def _tokenize(self, source: str) -> StapyTemplate:
+        source = source.replace('\\{', self._se.hash('{')).replace('\\}', self._se.hash('}'))
+        spans = []
+        for kind, bounds in self._bounds.items():
+            for match in self._expressions[bounds].finditer(source):
+                cleaned = match.group(1).replace('\n', ' ').replace('\t', ' ').strip(' ')
+                if not cleaned:
+                    return StapyTemplate(source)
+                spans.append((match.start(), match.end(), kind, cleaned))
+        spans.sort()
+        raws = {}
+        for span in spans:
+            raw = source[span[0]:span[1]]
+            raws[raw] = raws.get(raw, 0) + 1
+        if any(source.count(raw) != total for raw, total in raws.items()):
+            return StapyTemplate(source)
+        tags = []
+        for span in spans:
+            if not tags or span[0] >= tags[-1][0][1]:
+                tags.append((span, []))
+            elif span[2] == 'var' and tags[-1][0][2] != 'var' and span[1] <= tags[-1][0][1]:
+                tags[-1][1].append(span)
+            else:
+                return StapyTemplate(source)
+        nodes = []
+        position = 0
+        for _i, (span, children) in enumerate(tags):
+            (start, end, kind) = span[0:3]
+            following = tags[_i + 1][0][0] if _i + 1 < len(tags) else len(source)
+            if kind != 'var' and (
+                    (start > position and source[start - 1] in '{}%') or (following > end and source[end] in '{}%')):
+                return StapyTemplate(source)
+            if start > position:
+                nodes.append(StapyNode('text', source[position:start]))
+            nodes.append(self._get_node(source, span, children))
+            position = end
+        if position < len(source):
+            nodes.append(StapyNode('text', source[position:]))
+        return StapyTemplate(source, nodes)
+
+    def _get_node(self, source: str, span: tuple, children: list) -> StapyNode:
+        (start, end, kind, expr) = span
+        pieces = None
+        if children:
+            pieces = []
+            position = start
+            for child in children:
+                if child[0] > position:
+                    pieces.append(StapyNode('text', source[position:child[0]]))
+                pieces.append(StapyNode('var', source[child[0]:child[1]], child[3], child[3].split(' ')[0]))
+                position = child[1]
+            if position < end:
+                pieces.append(StapyNode('text', source[position:end]))
+        if kind == 'var' or '{' in expr or '^' in expr:
+            return StapyNode(kind, source[start:end], expr, expr.split(' ')[0], pieces=pieces)
+        cleaned = self._se.encode_exp(expr)
+        args = None
+        if kind == 'plugin':
+            args = {}
+            self._add_args_to_data(args, cleaned)
+        elif len(cleaned.rsplit(' + ', 1)) > 1:
+            kind = 'data'
+        elif len(cleaned.rsplit(' ~ ', 1)) > 1:
+            kind = 'query'
+        return StapyNode(kind, source[start:end], expr, expr.split(' ')[0], cleaned, args, pieces)
+
+    def _render(self, data: dict, template: StapyTemplate) -> str:
+        if template.nodes is None:
+            content = self._plugin_tags(data, template.source)
+            content = self._template_tags(data, content)
+            return self._content_tags(data, content)
+        nodes = template.nodes
+        results = {}
+        replaced = []
+        safe = True
+        for node in nodes:
+            if node.kind == 'plugin':
+                result = self._plugin_node(data, node)
+                if result is None:
+                    continue
+                replaced.append((node.raw, result))
+                if node.raw not in results:
+                    results[node.raw] = result
+                safe = safe and self._is_inert(result)
+        if not safe:
+            return self._content_tags(data, self._template_tags(data, self._replace(template.source, replaced)))
+        blocks = {}
+        for node in nodes:
+            if node.kind in ('block', 'data', 'query') and node.raw not in blocks:
+                result = blocks[node.raw] = self._block_node(data, node)
+                safe = safe and (result is None or self._is_inert(result))
+        if not safe:
+            return self._content_tags(data, self._replace(template.source, replaced, blocks.items()))
+        results.update((raw, result) for raw, result in blocks.items() if result is not None)
+        values = {}
+        output = []
+        for node in nodes:
+            if node.kind == 'text':
+                output.append(node.raw)
+            elif node.raw in results:
+                output.append(results[node.raw])
+            elif node.kind == 'var':
+                output.append(self._var_node(data, node, values))
+            elif node.pieces is None:
+                output.append(node.raw)
+            else:
+                output.extend(self._var_node(data, piece, values) for piece in node.pieces)
+        if not all(inert for _value, inert in values.values()):
+            return self._content_tags(data, self._replace(template.source, replaced, blocks.items()))
+        return ''.join(output)
+
+    @staticmethod
+    def _replace(content: str, *results) -> str:
+        for items in results:
+            for raw, result in items:
+                if result is not None:
+                    content = content.replace(raw, result)
+        return content
+
+    def _is_inert(self, content: str) -> bool:
+        if not content:
+            return True
+        if content[0] in '{}%' or content[-1] in '{}%':
+            return False
+        if '{' not in content and '}' not in content:
+            return True
+        return not any(sequence in content for sequence in self._unsafe)
+
+    def _var_node(self, data: dict, node: StapyNode, values: dict) -> str:
+        if node.kind == 'text':
+            return node.raw
+        if node.raw not in values:
+            value = None
+            for key in (node.expr, node.expr + '.' + self._env):
+                value = data[key] if key in data else value
+            if value is None:
+                values[node.raw] = (node.raw, True)
+            else:
+                value = str(value)
+                values[node.raw] = (value, '{' not in value and '}' not in value)
+        return values[node.raw][0]
+
+    def _plugin_node(self, data: dict, node: StapyNode) -> str or None:
+        args = {}
+        if node.args is None:
+            self._add_args_to_data(args, self._clean_tag(node.expr, data))
+        else:
+            args.update(node.args)
+        args['env'] = self._env
+        args['path'] = self._path
+        result = self._directive_result(node.name, data, args)
+        if result is not None:
+            return self._parse(data, result)
+        return None
+
+    def _directive_result(self, method: str, data: dict, args: dict) -> str or None:
+        key = self._sp.get_cache_key(method, args) if self._cache.has_directives() or self._frames else None
+        if key is None:
+            self._mark_frames('volatile')
+        self._mark_frames('env')
+        result = self._cache.get_directive(method, key, self._missing)
+        if result is not self._missing:
+            return result
+        data = data.get_data() if isinstance(data, StapyScope) else data
+        result = self._sp.dispatch(method, data, False, **args)
+        result = str(result) if result != data else None
+        self._cache.add_directive(key, result)
+        return result
+
+    def _block_node(self, data: dict, node: StapyNode) -> str or None:
+        tpl = None
+        for key in (node.name, node.name + '.' + self._env):
+            tpl = data[key] if key in data else tpl
+        if not isinstance(tpl, str) or tpl == '':
+            return None
+        cleaned = self._clean_tag(node.expr, data) if node.cleaned is None else node.cleaned
+        return self._block_result(tpl, cleaned, data, node.name)
+
+    def _find_expressions(self, bounds: tuple, content: str) -> list:
+        result = []
+        for expression in self._expressions[bounds].findall(content):
+            cleaned = expression.replace('\n', ' ').replace('\t', ' ').strip(' ')
+            if cleaned:
+                result.append((bounds[0] + expression + bounds[1], cleaned))
+        return result
+
+    def _content_tags(self, data: dict, content: str, escape: bool = False) -> str:
+        tags = self._find_expressions(('{{', '}}'), content)
+        for tag in tags:
+            keys = [tag[1], tag[1] + '.' + self._env]
+            value = None
+            for key in keys:
+                value = data[key] if key in data else value
+            if value is not None:
+                if escape:
+                    value = value.replace('"', '\\"').replace("'", "\\'")
+                content = content.replace(tag[0], str(value))
+        return content
+
+    def _plugin_tags(self, data: dict, content: str) -> str:
+        tags = self._find_expressions(('{:', ':}'), content)
+        for tag in tags:
+            parts = tag[1].split(' ')
+            method = parts[0]
+            args = {}
+            cleaned = self._clean_tag(tag[1], data)
+            self._add_args_to_data(args, cleaned)
+            args['env'] = self._env
+            args['path'] = self._path
+            result = self._directive_result(method, data, args)
+            if result is not None:
+                content = content.replace(tag[0], self._parse(data, result))
+        return content
+
+    def _template_tags(self, data: dict, content: str) -> str:
+        tags = self._find_expressions(('{%', '%}'), content)
+        tags = list(set(tags))
+        for tag in tags:
+            parts = tag[1].split(' ')
+            block = parts[0]
+            keys = [block, block + '.' + self._env]
+            tpl = None
+            for key in keys:
+                tpl = data[key] if key in data else tpl
+            if not isinstance(tpl, str) or tpl == '':
+                continue
+            content = content.replace(tag[0], self._block_result(tpl, self._clean_tag(tag[1], data), data, block))
+        return content
+
+    def _block_result(self, tpl: str, cleaned: str, data: dict, block: str) -> str:
+        if not self._cache.has_fragments():
+            return self._render_block(tpl, cleaned, data, block)
+        key = (block, tpl, cleaned)
+        cached = self._cache.get_fragment(key, lambda variant: self._get_fragment_values(data, variant))
+        if cached is not None:
+            ((with_path, env, names), (result, dependencies)) = cached
+            for frame in self._frames:
+                frame['reads'].update(self._get_env_name(name) for name in names)
+                frame['path'] = frame['path'] or with_path
+                frame['env'] = frame['env'] or env is not None
+            self._fs.get_dependencies().add(*dependencies)
+            return result
+        frame = {'reads': set(), 'path': False, 'env': False, 'volatile': False}
+        self._frames.append(frame)
+        self._fs.get_dependencies().record()
+        try:
+            scope = data if isinstance(data, StapyScope) and data.frames else StapyScope(data, frames=self._frames)
+            result = self._render_block(tpl, cleaned, scope, block)
+        finally:
+            self._frames.pop()
+            dependencies = self._fs.get_dependencies().release()
+        if not frame['volatile']:
+            variant = (frame['path'], self._env if frame['env'] else None, self._get_fragment_names(frame['reads']))
+            values = self._get_fragment_values(data, variant)
+            self._cache.add_fragment(key, variant, values, result, dependencies)
+        return result
+
+    def _get_fragment_names(self, reads: set) -> tuple:
+        """Names read by a fragment, a 'key.<env>' name is also kept as (key,) to be resolved in any environment"""
+        suffix = '.' + self._env
+        names = set(reads)
+        names.update((name[:-len(suffix)],) for name in reads if isinstance(name, str) and name.endswith(suffix))
+        return tuple(sorted(names, key=str))
+
+    def _get_env_name(self, name: Any) -> Any:
+        return name[0] + '.' + self._env if isinstance(name, tuple) else name
+
+    def _get_fragment_values(self, data: dict, variant: tuple) -> tuple or None:
+        (with_path, env, names) = variant
+        if env is not None and env != self._env:
+            return None
+        values = [self._path if with_path else None]
+        for name in map(self._get_env_name, names):
+            value = data.peek(name, self._missing) if isinstance(data, StapyScope) else data.get(name, self._missing)
+            if value is self._missing:
+                values.append(None)
+            elif type(value) in StapyJsonQueryIndex.scalars:
+                values.append((type(value), value))
+            else:
+                values.append((type(value), repr(value)))
+        return tuple(values)
+
+    @staticmethod
+    def _get_hook_data(data: dict) -> dict:
+        return data.copy() if isinstance(data, StapyScope) else data
+
+    def _mark_frames(self, *flags: str) -> None:
+        for frame in self._frames:
+            for flag in flags:
+                frame[flag] = True
+
+    def _render_block(self, tpl: str, cleaned: str, data: dict, block: str) -> str:
+        tag_data = cleaned.rsplit(' + ', 1)
+        tag_query = cleaned.rsplit(' ~ ', 1)
+        if len(tag_data) > 1:
+            return self._tpl_file_data(tpl, tag_data[0], tag_data[1], data, block)
+        if len(tag_query) > 1:
+            return self._tpl_file_query(tpl, tag_query[0], tag_query[1], data, block)
+        return self._tpl_file(tpl, cleaned, data, block)
+
+    def _clean_tag(self, tag: str, data: dict) -> str:
+        return self._se.encode_exp(self.clean(self._content_tags(data, tag, True)))
+
+    def _tpl_file(self, template: str, args: str, data: dict, key: str) -> str:
+        child_data = {}
+        self._add_args_to_data(child_data, args)
+        return self._get_child_content(data, child_data, template, key)
+
+    def _tpl_file_data(self, template: str, args: str, path: str, data: dict, key: str) -> str:
+        child = self._fs.get_page_data(path)
+        self._add_args_to_data(child, args)
+        if self._sp.has('child_content_data'):
+            self._mark_frames('path', 'env')
+            child = self._sp.dispatch(
+                'child_content_data', child, True,
+                key=key, env=self._env, path=self._path, data=self._get_hook_data(data)
+            )
+        return self._get_child_content(data, child, template, key)
+
+    def _tpl_file_query(self, template: str, args: str, query: str, data: dict, key: str) -> str:
+        if not self._sp.has('child_content_query_result'):
+            pages = self._jq.fetch_views(query)
+        else:
+            self._mark_frames('path', 'env')
+            pages = self._sp.dispatch(
+                'child_content_query_result', self._jq.fetch(query), True,
+                key=key, env=self._env, path=self._path, data=self._get_hook_data(data)
+            )
+        children = []
+        separator = ''
+        templates = {}
+        for child in pages:
+            self._add_args_to_data(child[1], args)
+            name = child[1]['_child_template'] if '_child_template' in child[1] else template
+            if name not in templates:
+                templates[name] = self._get_child_template(name)
+            children.append(self._render_child(data, child[1], templates[name], key))
+            separator = (child[1]['delimiter'] if 'delimiter' in child[1] else '') + '\n'
+        return separator.join(children)
+
+    def _add_args_to_data(self, data: dict, args: str) -> None:
+        args = args.replace('"', '').replace("'", '')
+        if args.strip(' '):
+            try:
+                for arg in args.split(' '):
+                    values = arg.split(':')
+                    if len(values) == 2:
+                        data[self._se.decode_exp(values[0])] = self._se.decode_exp(values[1])
+            except Exception as exception:
+                raise Exception('Arguments syntax error\n' + str(exception)) from exception
+
+    def _get_child_content(self, page_data: dict, child_data: dict, template: str, key: str) -> str:
+        template = self._get_child_template(
+            child_data['_child_template'] if '_child_template' in child_data else template
+        )
+        return self._render_child(page_data, child_data, template, key)
+
+    def _render_child(self, page_data: dict, child_data: dict, template: StapyTemplate or None, key: str) -> str:
+        if template is None:
+            return ''
+        child_data = {'$' + str(k): v for k, v in child_data.items()}
+        merged_data = StapyScope(page_data, child_data, (key, key + '.' + self._env), self._frames or None)
+        return self._render(merged_data, template)
+
+    def _get_child_template(self, template: str) -> StapyTemplate or None:
+        if not template:
+            return None
+        try:
+            return self.get_template(self._fs.get_source_dir(template))
+        except OSError as os_error:
+            raise Exception(str(os_error)) from os_error
+
+
+class StapyEncoder:
+    _hashes = {}
+    _spaces = re.compile(' +')
+
+    def __init__(self, protected_exp: list = None) -> None:
+        if protected_exp is None:
+            protected_exp = [' ', ':', '+', '~', '"', '\'', '!=', '>=', '<=', '=', '>', '<', ')', '(', 'where', 'WHERE']
+        self._protected_exp = protected_exp
+        self._encoded = {exp: self.hash(exp) for exp in protected_exp}
+        self._decoded = {encoded: exp for exp, encoded in self._encoded.items()}
+        self._encoder = re.compile('|'.join(re.escape(exp) for exp in protected_exp)) if protected_exp else None
+        self._decoder = re.compile('|'.join(re.escape(encoded) for encoded in self._decoded)) if protected_exp else None
+        self._quoted = {quote: re.compile(rf'{quote}(.+?){quote}') for quote in ('"', "'")}
+
+    def encode_exp(self, value: str) -> str:
+        value = self.__encode_escaped_quotes(value, '"')
+        value = self.__encode_escaped_quotes(value, "'")
+        if '"' in value or "'" in value:
+            value = self.__encode_char_between_quotes(value, '"', "'")
+            value = self.__encode_char_between_quotes(value, "'", '"')
+            value = self.__encode_protected_exp(value, '"')
+            value = self.__encode_protected_exp(value, "'")
+        return self._spaces.sub(' ', value).strip(' ')
+
+    def decode_exp(self, value: str) -> str:
+        if self._decoder is None or '^' not in value:
+            return value
+        return self._decoder.sub(lambda match: self._decoded[match.group(0)], value)
+
+    @staticmethod
+    def hash(value: str) -> str:
+        encoded = StapyEncoder._hashes.get(value)
+        if encoded is None:
+            encoded = '^' + hashlib.md5(value.encode()).hexdigest() + '$'
+            if len(StapyEncoder._hashes) < 1024:
+                StapyEncoder._hashes[value] = encoded
+        return encoded
+
+    def __encode_escaped_quotes(self, value: str, quote: str) -> str:
+        return value.replace(f'\\{quote}', self.hash(quote)) if '\\' in value else value
+
+    def __encode_char_between_quotes(self, value: str, quote: str, char: str) -> str:
+        strings = self._quoted[quote].findall(value)
+        for string in strings:
+            value = value.replace(string, string.replace(char, self.hash(char)))
+        return value
+
+    def __encode_protected_exp(self, value: str, quote: str) -> str:
+        if self._encoder is None:
+            return value
+        strings = self._quoted[quote].findall(value.replace(f':{quote}{quote} ', ': '))
+        for string in strings:
+            encoded = self._encoder.sub(lambda match: self._encoded[match.group(0)], string)
+            value = value.replace(f'{quote}{string}{quote}', f'{quote}{encoded}{quote}')
+        return value
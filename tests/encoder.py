@@ -0,0 +1,100 @@
+import hashlib
+import os
+import random
+import re
+import sys
+import timeit
+from stapy import StapyEncoder
+
+
+class ReferenceEncoder:
+    """Encoder of Stapy 1.17.12, before the single pass rewrite"""
+    def __init__(self, protected_exp: list = None) -> None:
+        if protected_exp is None:
+            protected_exp = [' ', ':', '+', '~', '"', '\'', '!=', '>=', '<=', '=', '>', '<', ')', '(', 'where', 'WHERE']
+        self._protected_exp = protected_exp
+
+    def encode_exp(self, value: str) -> str:
+        value = self.__encode_escaped_quotes(value, '"')
+        value = self.__encode_escaped_quotes(value, "'")
+        value = self.__encode_char_between_quotes(value, '"', "'")
+        value = self.__encode_char_between_quotes(value, "'", '"')
+        value = self.__encode_protected_exp(value, '"')
+        value = self.__encode_protected_exp(value, "'")
+        return re.sub(' +', ' ', value).strip(' ')
+
+    def decode_exp(self, value: str) -> str:
+        for exp in self._protected_exp:
+            value = value.replace(self.hash(exp), exp)
+        return value
+
+    @staticmethod
+    def hash(value: str) -> str:
+        return '^' + hashlib.md5(value.encode()).hexdigest() + '$'
+
+    def __encode_escaped_quotes(self, value: str, quote: str) -> str:
+        return value.replace(f'\\{quote}', self.hash(quote))
+
+    def __encode_char_between_quotes(self, value: str, quote: str, char: str) -> str:
+        strings = re.findall(rf'{quote}(.+?){quote}', value)
+        for string in strings:
+            value = value.replace(string, string.replace(char, self.hash(char)))
+        return value
+
+    def __encode_protected_exp(self, value: str, quote: str) -> str:
+        strings = re.findall(rf'{quote}(.+?){quote}', value.replace(f':{quote}{quote} ', ': '))
+        for string in strings:
+            origin = string
+            for exp in self._protected_exp:
+                string = string.replace(exp, self.hash(exp))
+            value = value.replace(f'{quote}{origin}{quote}', f'{quote}{string}{quote}')
+        return value
+
+
+def get_tags() -> list:
+    tags = []
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'source')
+    for directory, _directories, files in os.walk(source):
+        for name in sorted(files):
+            if name.endswith('.html'):
+                with open(os.path.join(directory, name), encoding='utf-8') as file:
+                    tags += re.findall(r'\{([%:])(.+?)\1}', file.read(), re.DOTALL)
+    return [tag[1].strip() for tag in tags]
+
+
+def render(encoder, tags: list) -> list:
+    return [[encoder.decode_exp(arg) for arg in encoder.encode_exp(tag).split(' ')] for tag in tags]
+
+
+def fuzz(encoder, reference, count: int) -> int:
+    generator = random.Random(1985)
+    alphabet = ['a', 'b', ' ', '  ', ':', '+', '~', '"', '\'', '\\"', '\\\'', '!=', '>=', '<=', '=', '>', '<',
+                '(', ')', 'where', 'WHERE', '^', '$', '\n']
+    for _ in range(count):
+        value = ''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 24)))
+        encoded = encoder.encode_exp(value)
+        if encoded != reference.encode_exp(value) or encoder.decode_exp(encoded) != reference.decode_exp(encoded):
+            print(f'Different output for: {value!r}')
+            return 1
+    return 0
+
+
+def main() -> int:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    encoder = StapyEncoder()
+    reference = ReferenceEncoder()
+    tags = get_tags()
+    if render(encoder, tags) != render(reference, tags):
+        print('Different output for the tags in tests/source')
+        return 1
+    for name, instance in (('reference', reference), ('current', encoder)):
+        seconds = min(timeit.repeat(lambda item=instance: render(item, tags), number=100, repeat=5)) / 100
+        print(f'[{name}] {str(round(seconds * 1000000 / len(tags), 1))} us per tag ({str(len(tags))} tags)')
+    result = fuzz(encoder, reference, count)
+    if not result:
+        print(f'{str(count)} random expressions encoded and decoded with the same output')
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,23 @@
+build_state = {}
+
+
 def page_data_merged(data: dict) -> dict:
     data['plugin'] = 'ok'
     return data
 
 
+def pages_data_loaded(pages: dict) -> dict:
+    for data in pages.values():
+        data['pages_total'] = len(pages)
+        data['pages_loaded'] = data.get('pages_loaded', 0) + 1
+    return pages
+
+
 def child_content_data(data: dict, args: dict) -> dict:
     if args['key'] == 'child_block':
         data['smiley'] = ':)'
+    if args['key'] == 'type_block':
+        data['parent_type'] = type(args['data']).__name__
     return data
 
 
@@ -23,6 +35,16 @@ def child_content_query_result(items: list, args: dict) -> list:
     return items
 
 
+def build_state_saved(state: dict, args: dict) -> dict:
+    state['test'] = 'ok'
+    return state
+
+
+def build_state_loaded(state: dict, args: dict) -> dict:
+    build_state.update(state)
+    return state
+
+
 def plugin_directive(data: dict, args: dict) -> str:
     env = args['env']
     if env == 'local':
@@ -38,9 +60,17 @@ def inception_plugin(data: dict, args: dict) -> str:
     return '{% block.inception %}'
 
 
+def data_type_plugin(data: dict, args: dict) -> str:
+    return type(data).__name__
+
+
 def plugin_directive_custom_arg(data: dict, args: dict) -> str:
     return ' '.join([args['foo'], args['name'], args['simple'], args['feeling_1'], args['feeling_2'], args['chars']])
 
 
 def specific_plugin_directive() -> str:
     return 'Specific'
+
+
+plugin_directive.cacheable = True
+specific_plugin_directive.cacheable = True
@@ -1,15 +1,34 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
 import unittest
 from stapy import StapyPluginsAdapter
+from stapy import StapyPluginsInterface
 from stapy import StapyPlugins
 from stapy import StapyFileSystem
+from stapy import StapyPagesIndex
 from stapy import StapyParser
 from stapy import StapyJsonQuery
 from stapy import StapyEncoder
 from stapy import StapyGenerator
+from stapy import StapyScope
+from stapy import StapyWatcher
 
 
+fixtures = os.path.dirname(os.path.abspath(__file__))
+fixture_pages = [
+    file for _directory, _directories, files in os.walk(os.path.join(fixtures, 'source', 'pages'))
+    for file in files if file.endswith('.json')
+]
+root = tempfile.TemporaryDirectory()
+for name in ('source', 'plugins'):
+    shutil.copytree(os.path.join(fixtures, name), os.path.join(root.name, name))
+sys.path.insert(0, root.name)
+
 plugins = StapyPluginsAdapter()
-file_system = StapyFileSystem(plugins)
+file_system = StapyFileSystem(plugins, root.name)
 encoder = StapyEncoder()
 json_query = StapyJsonQuery(file_system, encoder)
 parser = StapyParser(plugins, file_system, json_query, encoder)
@@ -17,6 +36,16 @@ generator = StapyGenerator(file_system, json_query, parser)
 plugins.set(StapyPlugins(file_system, json_query, parser, generator))
 
 
+def tearDownModule():
+    root.cleanup()
+
+
+def touch(file: str) -> None:
+    """Move the modification time forward, a rewrite can keep the same time on coarse file systems"""
+    stat = os.stat(file)
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+
 class TestServer(unittest.TestCase):
 
     def test_environments(self):
@@ -32,6 +61,42 @@ class TestServer(unittest.TestCase):
         self.assertIn(file_system.get_file_type('index.html'), 'text/html')
         self.assertIn(file_system.get_file_type('index.html.json'), 'application/json')
 
+    def test_file_cache(self):
+        file = file_system.get_source_dir('template/block/simple.html')
+        file_system.get_file_cache().configure(True, True, 1024)
+        content = file_system.get_file_content(file)
+        self.assertIs(file_system.get_file_content(file), content)
+        stats = file_system.get_file_cache().get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['files']), (1, 1, 1))
+        self.assertEqual(stats['size'], len(content.encode()))
+        # Eviction
+        file_system.get_file_cache().configure(True, False, len(content.encode()))
+        file_system.get_file_content(file)
+        file_system.get_file_content(file_system.get_source_dir('template/block/child.html'))
+        self.assertEqual(file_system.get_file_cache().get_stats()['files'], 1)
+        file_system.get_file_cache().configure(False)
+        self.assertEqual(file_system.get_file_cache().get_stats()['files'], 0)
+
+    def test_create_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'web', 'index.html')
+            self.assertTrue(file_system.create_file(file, 'foo\n', skip_unchanged=True))
+            os.utime(file, ns=(0, 0))
+            self.assertFalse(file_system.create_file(file, 'foo\n', skip_unchanged=True))
+            self.assertEqual(os.stat(file).st_mtime_ns, 0)
+            self.assertTrue(file_system.create_file(file, 'foo\n'))
+            self.assertTrue(file_system.create_file(file, 'bar\n', skip_unchanged=True))
+            self.assertEqual(file_system.get_file_content(file), 'bar\n')
+            self.assertEqual(os.listdir(os.path.dirname(file)), ['index.html'])
+            # Permissions and symlinks
+            os.chmod(file, 0o640)
+            link = os.path.join(directory, 'link.html')
+            os.symlink(file, link)
+            self.assertTrue(file_system.create_file(link, 'baz\n'))
+            self.assertTrue(os.path.islink(link))
+            self.assertEqual(file_system.get_file_content(file), 'baz\n')
+            self.assertEqual(os.stat(file).st_mode & 0o777, 0o640)
+
     def test_page_data(self):
         # Template var
         self.assertIn('template', file_system.get_page_data('/index.html'))
@@ -60,6 +125,133 @@ class TestServer(unittest.TestCase):
             file_system.get_page_data('index.html')
         )
 
+    def test_layout_data(self):
+        data = file_system.get_page_data('/foo/bar/index.html')
+        self.assertEqual(data['subdir'], 'bar')
+        data['subdir'] = 'updated'
+        self.assertEqual(file_system.get_page_data('/foo/bar/index.html')['subdir'], 'bar')
+        # Layout update
+        file = file_system.get_layout_config('foo/bar/html')
+        content = file_system.get_file_content(file)
+        try:
+            file_system.create_file(file, '{"subdir": "baz"}')
+            touch(file)
+            self.assertEqual(file_system.get_page_data('/foo/bar/index.html')['subdir'], 'baz')
+        finally:
+            file_system.create_file(file, content)
+        self.assertEqual(file_system.get_page_data('/foo/bar/index.html')['subdir'], 'bar')
+
+    def test_page_data_cache(self):
+        file_system.get_file_cache().set_page_data(True)
+        try:
+            data = file_system.get_page_data('/index.html')
+            data['tags'].append('updated')
+            data['title'] = 'updated'
+            cached = file_system.get_page_data('/index.html')
+            self.assertIsNot(cached, data)
+            self.assertEqual(cached['tags'], ['test'])
+            self.assertEqual(cached['title'], 'It works!')
+        finally:
+            file_system.get_file_cache().set_page_data(False)
+        self.assertEqual(file_system.get_page_data('/index.html'), cached)
+
+    def test_pages_data_refresh(self):
+        pages = file_system.get_pages_data()
+        file_system.get_pages().refresh()
+        self.assertIs(file_system.get_pages_data()['/index.html'], pages['/index.html'])
+        # Page update
+        file = file_system.get_page_config('/index.html')
+        touch(file)
+        file_system.get_pages().refresh()
+        refreshed = file_system.get_pages_data()
+        self.assertIsNot(refreshed['/index.html'], pages['/index.html'])
+        self.assertIs(refreshed['/child.html'], pages['/child.html'])
+        self.assertEqual(refreshed['/child.html']['pages_loaded'], 1)
+        self.assertEqual(list(refreshed), list(pages))
+        self.assertEqual(file_system.get_pages().reset(), len(pages))
+        # Plugin API aliases
+        file_system.get_pages_data()
+        self.assertEqual(file_system.reset_pages_data(), len(pages))
+        self.assertTrue(file_system.is_enabled(pages['/index.html']))
+        self.assertFalse(file_system.is_enabled({'enabled': 0}))
+        # Bulk hook
+        self.assertEqual(pages['/index.html']['pages_total'], len(pages))
+        self.assertNotIn('pages_total', file_system.get_page_data('/index.html'))
+
+    def test_pages_data_loaded(self):
+        class Enrichment(StapyPluginsInterface):
+            def dispatch(self, method: str, value: dict, same_type: bool, args: dict) -> dict:
+                for data in value.values() if method == 'pages_data_loaded' else []:
+                    data.setdefault('tags', []).append('enriched')
+                return value
+
+            def has(self, method: str) -> bool:
+                return method == 'pages_data_loaded'
+
+        adapter = StapyPluginsAdapter()
+        adapter.set(Enrichment())
+        enriched = StapyFileSystem(adapter, file_system.get_root_dir())
+        self.assertEqual(enriched.get_pages_data()['/index.html']['tags'], ['test', 'enriched'])
+        touch(enriched.get_page_config('/child.html'))
+        enriched.get_pages().refresh()
+        self.assertEqual(enriched.get_pages_data()['/index.html']['tags'], ['test', 'enriched'])
+
+    def test_pages_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'pages.db')
+            file_system.get_pages().set_index(True, file)
+            try:
+                pages = file_system.get_pages_data()
+                self.assertEqual(len(file_system.get_pages().verify_index()['valid']), len(pages))
+                # The page_data_merged hook runs again on load
+                indexed = StapyPagesIndex(file, json.dumps([file_system.get_version()])).get()
+                self.assertNotIn('plugin', json.loads(indexed['/index.html'][1]))
+                file_system.get_pages().reset()
+                self.assertEqual(file_system.get_pages_data(), pages)
+                self.assertEqual(pages['/index.html']['plugin'], 'ok')
+                self.assertEqual(file_system.get_pages().rebuild_index(), len(pages))
+            finally:
+                file_system.get_pages().set_index(False)
+
+    def test_generate_pages(self):
+        file = file_system.get_page_config('/generate-test.html')
+        file_system.create_file(file, '{"template": "template/missing.html"}')
+        try:
+            self.assertEqual(generator.generate_pages(['/index.html'], 'local'), 1)
+            with self.assertRaisesRegex(Exception, 'Error when generating "/generate-test.html"'):
+                generator.generate_pages(['/index.html', '/generate-test.html'], 'local')
+        finally:
+            os.remove(file)
+
+    def test_record_pages(self):
+        query = 'SELECT ITEMS 1-10 WHERE "test" in tags ORDER BY query_test asc'
+        for fragments in (False, True):
+            parser.set_fragment_cache(fragments)
+            try:
+                for _ in range(2):
+                    dependencies = generator.record_pages(['/query.html'], 'local')['/query.html']
+                    self.assertIn(('file', file_system.get_page_config('/query.html')), dependencies)
+                    self.assertIn(('file', file_system.get_layout_config('common')), dependencies)
+                    self.assertIn(('file', file_system.get_source_dir('content/query.html')), dependencies)
+                    self.assertIn(('file', file_system.get_source_dir('template/block/query.html')), dependencies)
+                    self.assertIn(('query', query, False), dependencies)
+            finally:
+                parser.set_fragment_cache(False)
+        self.assertEqual(generator.get_dependency_state(('query', query, False)), json_query.get_digest(query))
+        self.assertIsNone(generator.get_dependency_state(('file', 'source/missing.json')))
+
+    def test_watcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'sub', 'page.json')
+            watcher = StapyWatcher([directory])
+            self.assertEqual(watcher.poll(), [])
+            file_system.create_file(file, '{}')
+            file_system.create_file(os.path.join(directory, '__pycache__', 'page.pyc'), '')
+            self.assertEqual(watcher.poll(), [file])
+            self.assertEqual(watcher.poll(), [])
+            os.remove(file)
+            self.assertEqual(watcher.wait(0.01), [file])
+
     def test_template_engine_var(self):
         self.assertEqual(parser.process({'foo': 'bar'}, '{{ foo }}', 'local'), 'bar')
         self.assertEqual(parser.process({'foo': 'bar'}, '{{ foo }} {{ foo }}', 'local'), 'bar bar')
@@ -67,6 +259,65 @@ class TestServer(unittest.TestCase):
         self.assertEqual(parser.process({'foo.prod': 'bar'}, '{{ foo }}', 'prod'), 'bar')
         self.assertEqual(parser.process({'foo.local': 'bar'}, '{{ foo }}', 'local'), 'bar')
 
+    def test_template_engine_compiled(self):
+        data = {'foo': 'bar', 'block': 'template/block/simple.html'}
+        self.assertEqual(parser.process(dict(data), '\\{{ foo \\}} {{ foo }}', 'local'), '{{ foo }} bar')
+        self.assertEqual(
+            parser.process(dict(data), '{% block message:"{{ foo }}" %}{% block %}', 'local'),
+            'It works! barIt works! '
+        )
+        self.assertEqual(parser.process(dict(data), '{{ {{ foo }}', 'local'), '')
+        self.assertEqual(parser.process(dict(data), '{% missing {{ foo }} %}{{ foo }}', 'local'), 'bar')
+        self.assertEqual(parser.process(dict(data), '{{ foo }}{{ bar }}', 'local'), 'bar')
+        # Parsed template cache
+        template = parser.get_template(file_system.get_source_dir('template/block/simple.html'))
+        self.assertIsNotNone(template.nodes)
+        self.assertIs(parser.get_template(file_system.get_source_dir('template/block/simple.html')), template)
+        self.assertIs(parser.compile('{{ foo }}'), parser.compile('{{ foo }}'))
+
+    def test_scope(self):
+        page = {'title': 'foo', 'block': 'tpl', 'block.local': 'tpl', '$name': 'parent'}
+        scope = StapyScope(page, {'$name': 'child'}, ('block', 'block.local'))
+        self.assertEqual(scope['title'], 'foo')
+        self.assertEqual(scope['$name'], 'child')
+        self.assertNotIn('block', scope)
+        nested = StapyScope(scope, {'$index': 1}, ('title',))
+        self.assertNotIn('title', nested)
+        self.assertNotIn('block.local', nested)
+        nested['title'] = 'bar'
+        self.assertEqual(nested.copy(), {'$name': 'child', '$index': 1, 'title': 'bar'})
+        self.assertEqual((scope['title'], page['title']), ('foo', 'foo'))
+
+    def test_fragment_cache(self):
+        parser.set_fragment_cache(True)
+        try:
+            data = {'child': 'template/block/child.html', 'welcome': 'Hello', 'title': 'foo'}
+            result = parser.process(dict(data), '{% child name:John %}', 'local')
+            self.assertIn('Hello John', result)
+            self.assertEqual(parser.process(dict(data, title='bar'), '{% child name:John %}', 'local'), result)
+            self.assertIn('Hi John', parser.process(dict(data, welcome='Hi'), '{% child name:John %}', 'local'))
+            self.assertEqual(parser.get_fragment_cache_stats()['blocks']['child'], {'hits': 1, 'misses': 2})
+            # Expiration
+            self.assertEqual(parser.expire_fragments({('file', file_system.get_source_dir('missing.html'))}), 0)
+            self.assertEqual(parser.expire_fragments({('file', file_system.get_source_dir(data['child']))}), 2)
+            self.assertEqual(parser.get_fragment_cache_stats()['fragments'], 0)
+            # Plugin directives
+            data = {'inception': 'template/block/inception.html', 'message': 'foo'}
+            self.assertEqual(parser.process(dict(data), '{% inception %}', 'local'), 'foo')
+            self.assertEqual(parser.process(dict(data), '{% inception %}', 'local'), 'foo')
+            self.assertEqual(parser.get_fragment_cache_stats()['blocks']['inception'], {'hits': 0, 'misses': 2})
+            # Plugins receive plain dicts
+            data = {'type_block': 'template/block/type.html'}
+            self.assertEqual(parser.process(dict(data), '{% type_block + child/data %}', 'local'), 'dict dict')
+            # Environments
+            data = {'greeting': 'template/block/child.html', 'welcome': 'Hello', 'welcome.prod': 'Bye'}
+            self.assertIn('Hello Jane', parser.process(dict(data), '{% greeting name:Jane %}', 'devel'))
+            self.assertIn('Hello Jane', parser.process(dict(data), '{% greeting name:Jane %}', 'staging'))
+            self.assertIn('Bye Jane', parser.process(dict(data), '{% greeting name:Jane %}', 'prod'))
+            self.assertEqual(parser.get_fragment_cache_stats()['blocks']['greeting'], {'hits': 1, 'misses': 2})
+        finally:
+            parser.set_fragment_cache(False)
+
     def test_template_engine_tpl(self):
         # {{ title }}
         data = file_system.get_page_data('/index.html')
@@ -112,7 +363,7 @@ class TestServer(unittest.TestCase):
 
     def test_json_query(self):
         # Search
-        self.assertEqual(len(json_query.fetch('')), 12)
+        self.assertEqual(len(json_query.fetch('')), len(fixture_pages))
 
         self.assertEqual(len(json_query.fetch('SELECT ITEMS WHERE query_test = "1"')), 1)
         self.assertEqual(len(json_query.fetch('SELECT ITEMS WHERE query_test="1"')), 1)
@@ -201,6 +452,105 @@ class TestServer(unittest.TestCase):
             json_query.fetch('ORDER BY query_test desc WHERE "test" in tags SELECT ITEMS 1')[0][1]['query_test'], '2'
         )
 
+        # Compiled plan
+        where = json_query.build('SELECT ITEMS WHERE integer_search >= 20')[0]
+        self.assertTrue(callable(where))
+        self.assertIs(json_query.build('SELECT ITEMS WHERE integer_search >= 20')[0], where)
+        self.assertTrue(where({'integer_search': 20}))
+        self.assertFalse(where({'integer_search': 19}))
+        self.assertFalse(where({}))
+        self.assertIsNone(json_query.build('SELECT ITEMS 1')[0])
+        with self.assertRaises(TypeError):
+            json_query.fetch('SELECT ITEMS WHERE query_test > 1')
+        with self.assertRaises(ValueError):
+            json_query.fetch('SELECT ITEMS WHERE query_test = len(data)')
+
+        # Result cache
+        json_query.reset_result_cache()
+        json_query.fetch('SELECT ITEMS WHERE "test" in tags')[0][1]['query_test'] = 'updated'
+        self.assertEqual(json_query.fetch('SELECT ITEMS  WHERE "test"  in tags')[0][1]['query_test'], '2')
+        stats = json_query.get_result_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['queries']), (1, 1, 1))
+        json_query.fetch('SELECT ITEMS WHERE "test" in tags')[0][1]['tags'].append('updated')
+        self.assertNotIn('updated', json_query.fetch('SELECT ITEMS WHERE "test" in tags')[0][1]['tags'])
+        json_query.fetch('SELECT ITEMS WHERE "test" in tags', True)
+        self.assertEqual(json_query.get_result_cache_stats()['queries'], 2)
+
+        # Page views
+        self.assertIs(type(json_query.fetch('SELECT ITEMS WHERE "test" in tags')[0][1]), dict)
+        page = json_query.fetch_views('SELECT ITEMS WHERE "test" in tags')[0][1]
+        page['query_test'] = 'updated'
+        del page['tags']
+        self.assertEqual(page.get('query_test'), 'updated')
+        self.assertNotIn('tags', page)
+        self.assertEqual(page.copy(), {key: value for key, value in page.items()})
+        self.assertEqual(file_system.get_pages_data()['/' + page['_full_path']]['query_test'], '2')
+        self.assertIn('tags', file_system.get_pages_data()['/' + page['_full_path']])
+
+    def test_json_query_index(self):
+        query = 'SELECT ITEMS WHERE "index_test" in tags AND (index_value = 1 OR index_value = "1")'
+        self.assertEqual(len(json_query.fetch(query)), 0)
+        file = file_system.get_source_dir('pages') + os.sep + 'index-test.html.json'
+        try:
+            with open(file, 'w', encoding='utf-8') as page:
+                page.write('{"tags": ["index_test"], "index_value": 1}')
+            file_system.get_pages().refresh()
+            self.assertEqual(len(json_query.fetch(query)), 1)
+            self.assertEqual(len(json_query.fetch('SELECT ITEMS WHERE index_value = 1.0')), 1)
+            self.assertEqual(len(json_query.fetch('SELECT ITEMS WHERE "index" in tags')), 0)
+        finally:
+            os.remove(file)
+        file_system.get_pages().refresh()
+        self.assertEqual(len(json_query.fetch(query)), 0)
+        self.assertEqual(len(json_query.fetch('')), len(fixture_pages))
+
+    def test_json_query_order(self):
+        files = []
+        try:
+            for position in ['9', '10', '2023-01-10', '2023-01-09T12:00']:
+                files.append(file_system.get_source_dir('pages') + os.sep + 'order-' + position + '.html.json')
+                with open(files[-1], 'w', encoding='utf-8') as page:
+                    page.write('{"order_test": "' + position + '"}')
+            file_system.get_pages().refresh()
+            query = 'WHERE order_test != "" ORDER BY order_test'
+            self.assertEqual(
+                [page[1]['order_test'] for page in json_query.fetch(query)],
+                ['9', '10', '2023-01-09T12:00', '2023-01-10']
+            )
+            self.assertEqual(json_query.fetch(query + ' desc')[0][1]['order_test'], '2023-01-10')
+            self.assertEqual(json_query.fetch('SELECT ITEMS 2 ' + query)[0][1]['order_test'], '10')
+            files.append(file_system.get_source_dir('pages') + os.sep + 'order-8.html.json')
+            with open(files[-1], 'w', encoding='utf-8') as page:
+                page.write('{"order_test": 8}')
+            file_system.get_pages().refresh()
+            with self.assertRaises(TypeError):
+                json_query.fetch('SELECT ITEMS 1 WHERE order_test > 5 ORDER BY order_test')
+            json_query.set_typed_order(False)
+            self.assertEqual(json_query.fetch(query)[0][1]['order_test'], '10')
+            flag = file_system.get_root_dir() + 'string_order'
+            with open(flag, 'w', encoding='utf-8'):
+                pass
+            try:
+                self.assertEqual(StapyJsonQuery(file_system, encoder).fetch(query)[0][1]['order_test'], '10')
+            finally:
+                os.remove(flag)
+        finally:
+            json_query.set_typed_order(True)
+            for file in files:
+                os.remove(file)
+            file_system.get_pages().refresh()
+
+    def test_json_query_neighbors(self):
+        query = 'SELECT ITEMS WHERE "test" in tags ORDER BY query_test asc'
+        paths = ['/' + page['_full_path'] for _key, page in json_query.fetch(query)]
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(
+            json_query.get_neighbors(query, paths[0].lstrip('/')),
+            {'position': 1, 'total': 2, 'previous': None, 'next': paths[1]}
+        )
+        self.assertEqual(json_query.get_neighbors(query, paths[1])['previous'], paths[0])
+        self.assertIsNone(json_query.get_neighbors(query, '/missing.html')['position'])
+
     def test_template_engine_tpl_query(self):
         # {% query_block ~ tags:test query_test:asc 1:10 %}
         data = file_system.get_page_data('/query.html')
@@ -213,6 +563,15 @@ class TestServer(unittest.TestCase):
             parser.process(data, content, 'local'),
             '1 / 2 I\'m ~ "happy"\n2 / 2 I\'m ~ "happy"\n2 / 2 \n1 / 2  - \n2 / 2 '
         )
+        # Child templates are prepared once per block, not per item
+        loaded = []
+        get_template = parser.get_template
+        parser.get_template = lambda file: loaded.append(file) or get_template(file)
+        try:
+            parser.process(data, content, 'local')
+        finally:
+            del parser.get_template
+        self.assertEqual(len(loaded), 4)
 
     def test_template_plugin_directive(self):
         # {: plugin_directive :}
@@ -235,6 +594,66 @@ class TestServer(unittest.TestCase):
             'Prod!\nbar John " Doe Simple \' Quote I\'m :"Very \'Happy\'" I\'m :"Very \'Angry\'"  +:~"\'\nSpecific\n'
         )
 
+    def test_plugin_hooks(self):
+        self.assertTrue(plugins.has('page_data_merged'))
+        self.assertFalse(plugins.has('missing_hook'))
+        limited = StapyPlugins(file_system, json_query, parser, generator, 3600)
+        file = os.path.join(file_system.get_plugins_dir(), 'hook_test.py')
+        file_system.create_file(file, 'def missing_hook(value: str) -> str:\n    return value + "!"\n')
+        file_system.get_file_cache().configure(True)
+        try:
+            file_system.get_file_content(file)
+            pages = file_system.get_pages_data()
+            plugins.reload()
+            self.assertEqual(file_system.get_file_cache().get_stats()['files'], 0)
+            self.assertIsNot(file_system.get_pages_data()['/index.html'], pages['/index.html'])
+            self.assertFalse(plugins.has('page_data_merged_missing'))
+            self.assertNotIn('plugins.hook_test', sys.modules)
+            self.assertEqual(plugins.dispatch('missing_hook', 'ok', True), 'ok!')
+            # Modules are swapped, not updated in place
+            module = sys.modules['plugins.hook_test']
+            file_system.create_file(file, 'def missing_hook(value: str) -> str:\n    return value + "?"\n')
+            touch(file)
+            plugins.reload()
+            self.assertEqual(plugins.dispatch('missing_hook', 'ok', True), 'ok?')
+            self.assertEqual(module.missing_hook('ok'), 'ok!')
+            # Rate limited checks
+            limited.reload()
+            self.assertFalse(limited.has('missing_hook'))
+        finally:
+            file_system.get_file_cache().configure(False)
+            os.remove(file)
+        plugins.reload()
+        self.assertFalse(plugins.has('missing_hook'))
+
+    def test_build_state(self):
+        state = parser.get_build_state()
+        self.assertEqual(state, {'test': 'ok'})
+        parser.set_build_state({'test': 'loaded'})
+        self.assertEqual(sys.modules['plugins.test'].build_state, {'test': 'loaded'})
+        stats = generator.get_cache_stats()
+        self.assertEqual(set(stats), {'file', 'query', 'fragment', 'directive'})
+        self.assertEqual(generator.get_cache_stats(stats)['query'], {'hits': 0, 'misses': 0, 'queries': 0})
+
+    def test_directive_cache(self):
+        data = file_system.get_page_data('/plugin.html')
+        content = file_system.get_file_content(file_system.get_source_dir(data['template']))
+        parser.set_directive_cache(True)
+        try:
+            expected = parser.process(file_system.get_page_data('/plugin.html'), content, 'local')
+            self.assertEqual(parser.process(file_system.get_page_data('/plugin.html'), content, 'local'), expected)
+            self.assertNotEqual(parser.process(file_system.get_page_data('/plugin.html'), content, 'prod'), expected)
+            stats = parser.get_directive_cache_stats()['directives']
+            self.assertEqual(stats['plugin_directive'], {'hits': 1, 'calls': 2})
+            self.assertEqual(stats['plugin_directive_custom_arg'], {'hits': 0, 'calls': 3})
+        finally:
+            parser.set_directive_cache(False)
+        self.assertEqual(
+            plugins.get_cache_key('plugin_directive', {'env': 'local', 'path': '/index.html'}),
+            plugins.get_cache_key('plugin_directive', {'env': 'local', 'path': '/child.html'})
+        )
+        self.assertIsNone(plugins.get_cache_key('plugin_directive_custom_arg', {'env': 'local'}))
+
     def test_expression_syntax(self):
         # {% block.syntax %}
         data = file_system.get_page_data('/syntax.html')
@@ -248,6 +667,15 @@ class TestServer(unittest.TestCase):
             'okok ok\nok\nok\nok\nok\nok\nok\nok\nok\n    ok\n{% block.syntax %}'
         )
 
+    def test_encoder(self):
+        encoded = encoder.encode_exp('a:"b c" d:\'e>=f\' where:"x \\" y"')
+        self.assertEqual(encoded.count(' '), 2)
+        self.assertEqual(
+            [encoder.decode_exp(arg) for arg in encoded.split(' ')],
+            ['a:"b c"', 'd:\'e>=f\'', 'where:"x " y"']
+        )
+        self.assertEqual(StapyEncoder(['=']).decode_exp(encoder.hash('=') + encoder.hash(' ')), '=' + encoder.hash(' '))
+
     def test_infinite_loop(self):
         # {% block.loop %}
         data = file_system.get_page_data('/loop.html')